@@ -0,0 +1,140 @@
+"""A local stand-in for the Telegram Bot API, for load tests.
+
+Answers the Bot API methods the sellers bot calls with plausible results,
+without any network access. Every outgoing message is recorded per chat so
+the load generator can read keyboards and react to replies.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.web import Application, RequestHandler
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class ApiError(Exception):
+    def __init__(self, description: str, error_code: int = 400):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+
+
+class ChatLog:
+    def __init__(self):
+        self.messages = []  # (method, params) in the order the bot sent them
+        self.inline_keyboard = None  # last inline keyboard sent to the chat
+
+
+class FakeBotApi:
+    def __init__(self):
+        self.chats: dict[int, ChatLog] = defaultdict(ChatLog)
+        self.calls: dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1_000_000)
+        self._file_ids = itertools.count(1)
+        self._server = None
+        self.port = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self, port: int = 0):
+        app = Application([(r"/bot[^/]+/(\w+)", _MethodHandler, {"api": self})])
+        sockets = bind_sockets(port, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        self._server = HTTPServer(app)
+        self._server.add_sockets(sockets)
+
+    async def stop(self):
+        if self._server:
+            self._server.stop()
+            await self._server.close_all_connections()
+
+    def handle(self, method: str, params: dict):
+        self.calls[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method in ("deleteWebhook", "setWebhook", "answerCallbackQuery", "setMyCommands"):
+            return True
+        if method == "getUpdates":
+            return []
+
+        chat_id = int(params.get("chat_id", 0))
+        log = self.chats[chat_id]
+        log.messages.append((method, params))
+        markup = params.get("reply_markup")
+        if markup:
+            markup = json.loads(markup)
+            if "inline_keyboard" in markup:
+                log.inline_keyboard = markup["inline_keyboard"]
+        if method == "sendMediaGroup":
+            return [self._message(chat_id, params, item["type"], item["media"]) for item in json.loads(params["media"])]
+        if method in ("sendPhoto", "sendDocument"):
+            kind = method[4:].lower()
+            return self._message(chat_id, params, kind, params[kind])
+        return self._message(chat_id, params)
+
+    def _file(self, media) -> dict:
+        """Like Telegram, only accept file_ids this API handed out; uploads get a new one"""
+        if isinstance(media, str) and not media.startswith("attach://"):
+            if not media.startswith("bench-file-"):
+                raise ApiError("Bad Request: wrong file identifier/HTTP URL specified")
+            file_id = media
+        else:
+            file_id = f"bench-file-{next(self._file_ids)}"
+        return {"file_id": file_id, "file_unique_id": file_id[6:]}
+
+    def _message(self, chat_id: int, params: dict, kind: str | None = None, media=None) -> dict:
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if kind == "photo":
+            message["photo"] = [{**self._file(media), "width": 800, "height": 600}]
+        elif kind == "document":
+            message["document"] = self._file(media)
+        return message
+
+
+class _MethodHandler(RequestHandler):
+    def initialize(self, api: FakeBotApi):
+        self.api = api
+
+    def post(self, method):
+        params = {name: self.get_body_argument(name) for name in self.request.body_arguments}
+        # Uploaded files are recorded as tornado HTTPFile objects (filename, body)
+        params.update({name: files[0] for name, files in self.request.files.items()})
+        self.set_header("Content-Type", "application/json")
+        try:
+            self.write(json.dumps({"ok": True, "result": self.api.handle(method, params)}))
+        except ApiError as e:
+            self.set_status(e.error_code)
+            self.write(json.dumps({"ok": False, "error_code": e.error_code, "description": e.description}))
+
+    get = post
+
+
+if __name__ == "__main__":
+    async def _serve():
+        api = FakeBotApi()
+        await api.start(8081)
+        print(f"Fake Bot API listening on {api.base_url}")
+        await asyncio.Event().wait()
+
+    asyncio.run(_serve())
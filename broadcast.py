@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import logging
+import os
+import secrets
+import time
+from collections import deque
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+from sqlalchemy import func, or_, select, update
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from db import AsyncSessionLocal
+from metrics import BROADCAST_MESSAGES
+from models import Broadcast, Seller
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows bots about 30 messages per second overall and one per second per chat
+GLOBAL_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+CHAT_RATE = float(os.getenv("BROADCAST_CHAT_RATE", "1"))
+# A broadcast whose lease runs out (its process died) is picked up again
+LEASE_SECONDS = 60
+
+FinishedCallback = Callable[[Broadcast], Awaitable[None]]
+
+
+class _Progress:
+    """Counters and checkpoint of a running broadcast.
+
+    Messages finish out of order, so the checkpoint only advances past a
+    seller once every seller before it has finished too.
+    """
+
+    def __init__(self, broadcast: Broadcast):
+        self.id = broadcast.id
+        self.owner = broadcast.lease_owner
+        self.lease_lost = False
+        self.last_seller_id = broadcast.last_seller_id
+        self.counts = {"sent": broadcast.sent, "failed": broadcast.failed, "blocked": broadcast.blocked}
+        self.resumed_from = sum(self.counts.values())
+        self._order: deque[int] = deque()
+        self._done: set[int] = set()
+        self._since_checkpoint = 0
+        self._checkpoint_at = time.monotonic()
+
+    def started(self, seller_id: int):
+        self._order.append(seller_id)
+
+    def finished(self, seller_id: int, outcome: str):
+        self.counts[outcome] += 1
+        self._since_checkpoint += 1
+        self._done.add(seller_id)
+        while self._order and self._order[0] in self._done:
+            self.last_seller_id = self._order.popleft()
+            self._done.discard(self.last_seller_id)
+
+    def due(self, every: int) -> bool:
+        return self._since_checkpoint >= every or time.monotonic() - self._checkpoint_at > LEASE_SECONDS / 3
+
+    def checkpointed(self):
+        self._since_checkpoint = 0
+        self._checkpoint_at = time.monotonic()
+
+
+class Broadcaster:
+    """Sends a message to every seller, resumably.
+
+    Sellers are streamed in id order through server-side cursors, chunk by
+    chunk so no transaction stays open for the whole run. Sends go through
+    a global and a per-chat token bucket, and progress is checkpointed to
+    the broadcasts table, so a broadcast interrupted by a restart resumes
+    after the last seller it finished (a message in flight at the time may
+    be sent twice). Dry-run broadcasts do everything except call Telegram.
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE, concurrency: int = 32,
+                 chunk_size: int = 5000, batch_size: int = 500, checkpoint_every: int = 200,
+                 max_attempts: int = 3, dry_run_latency: float = 0.0,
+                 on_finished: Optional[FinishedCallback] = None):
+        self.bot = None
+        self.limiter = AsyncLimiter(rate, 1)
+        self.chat_rate = chat_rate
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.checkpoint_every = checkpoint_every
+        self.max_attempts = max_attempts
+        self.dry_run_latency = dry_run_latency
+        self.on_finished = on_finished
+        self._chat_limiters: TTLCache = TTLCache(maxsize=10000, ttl=60)
+        self._paused_until = 0.0
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    async def start(self, bot):
+        """Attach the bot and resume broadcasts left running by a previous process"""
+        self.bot = bot
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(Broadcast.id).where(Broadcast.status == "running"))
+            for broadcast_id in result.scalars():
+                self.launch(broadcast_id)
+
+    async def stop(self):
+        """Stop sending; running broadcasts keep their checkpoint and resume on next start"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def create(self, text: str, created_by: int, dry_run: bool = False) -> int:
+        async with AsyncSessionLocal() as session:
+            broadcast = Broadcast(text=text, created_by=created_by, dry_run=dry_run)
+            session.add(broadcast)
+            await session.commit()
+            return broadcast.id
+
+    def launch(self, broadcast_id: int):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self.run(broadcast_id), name=f"broadcast-{broadcast_id}")
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(status="cancelled", finished_at=datetime.now(), lease_until=None)
+                .returning(Broadcast.id)
+            )
+            cancelled = result.scalar_one_or_none() is not None
+            await session.commit()
+        task = self._tasks.get(broadcast_id)
+        if task:
+            task.cancel()
+        return cancelled
+
+    async def recent(self, limit: int = 5) -> list[Broadcast]:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(Broadcast).order_by(Broadcast.id.desc()).limit(limit))
+            return list(result.scalars())
+
+    async def run(self, broadcast_id: int):
+        """Send a broadcast to completion in this task, waiting out another process's lease"""
+        while True:
+            broadcast = await self._claim(broadcast_id)
+            if broadcast is not None:
+                break
+            async with AsyncSessionLocal() as session:
+                status = await session.scalar(select(Broadcast.status).where(Broadcast.id == broadcast_id))
+            if status != "running":
+                return
+            await asyncio.sleep(LEASE_SECONDS / 2)
+
+        start = time.monotonic()
+        progress = _Progress(broadcast)
+        finished = await self._deliver(broadcast, progress)
+        if not finished:
+            return
+
+        elapsed = time.monotonic() - start
+        counts = progress.counts
+        handled = sum(counts.values()) - progress.resumed_from
+        logger.info(
+            f"Broadcast {broadcast_id} finished: {counts['sent']} sent, {counts['failed']} failed, "
+            f"{counts['blocked']} blocked; {handled} in this run in {elapsed:.1f}s ({handled / elapsed if elapsed else 0:.1f}/s)"
+        )
+        if self.on_finished:
+            async with AsyncSessionLocal() as session:
+                broadcast = await session.get(Broadcast, broadcast_id)
+            try:
+                await self.on_finished(broadcast)
+            except Exception as e:
+                logger.error(f"Broadcast finished callback failed: {e}")
+
+    async def _claim(self, broadcast_id: int) -> Optional[Broadcast]:
+        # A fresh token per claim, so a process can tell its lease was taken over
+        owner = secrets.token_hex(8)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status == "running",
+                    or_(Broadcast.lease_until.is_(None), Broadcast.lease_until < func.now()),
+                )
+                .values(lease_until=func.now() + timedelta(seconds=LEASE_SECONDS), lease_owner=owner)
+                .returning(Broadcast)
+            )
+            broadcast = result.scalar_one_or_none()
+            await session.commit()
+            return broadcast
+
+    async def _checkpoint(self, progress: _Progress, finished: bool = False, release: bool = False) -> bool:
+        """Save progress and renew (or release) the lease; False if the broadcast was cancelled or taken over"""
+        values = dict(last_seller_id=progress.last_seller_id, updated_at=datetime.now(), **progress.counts)
+        if finished:
+            values.update(status="done", finished_at=datetime.now(), lease_until=None, lease_owner=None)
+        elif release:
+            values.update(lease_until=None, lease_owner=None)
+        else:
+            values.update(lease_until=func.now() + timedelta(seconds=LEASE_SECONDS))
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == progress.id, Broadcast.status == "running", Broadcast.lease_owner == progress.owner)
+                .values(**values)
+                .returning(Broadcast.id)
+            )
+            saved = result.scalar_one_or_none() is not None
+            await session.commit()
+        progress.checkpointed()
+        return saved
+
+    async def _renew_lease(self, progress: _Progress) -> bool:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == progress.id, Broadcast.status == "running", Broadcast.lease_owner == progress.owner)
+                .values(lease_until=func.now() + timedelta(seconds=LEASE_SECONDS))
+                .returning(Broadcast.id)
+            )
+            renewed = result.scalar_one_or_none() is not None
+            await session.commit()
+        return renewed
+
+    async def _heartbeat(self, progress: _Progress, sender: asyncio.Task):
+        """Keep the lease while sends are blocked (flood control, full semaphore); stop the sender if it is lost"""
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            try:
+                renewed = await self._renew_lease(progress)
+            except Exception as e:
+                # The lease is still valid for a while; try again on the next beat
+                logger.warning(f"Broadcast {progress.id} lease renewal failed: {e}")
+                continue
+            if not renewed:
+                progress.lease_lost = True
+                sender.cancel()
+                return
+
+    async def _sellers(self, after_id: int):
+        """Yield (seller id, telegram id) after after_id, one cursor per chunk"""
+        while True:
+            count = 0
+            async with AsyncSessionLocal() as session:
+                result = await session.stream(
+                    select(Seller.id, Seller.telegram_id)
+                    .where(Seller.id > after_id)
+                    .order_by(Seller.id)
+                    .limit(self.chunk_size)
+                    .execution_options(yield_per=self.batch_size)
+                )
+                async for seller_id, telegram_id in result:
+                    count += 1
+                    after_id = seller_id
+                    yield seller_id, telegram_id
+            if count < self.chunk_size:
+                return
+
+    async def _deliver(self, broadcast: Broadcast, progress: _Progress) -> bool:
+        """Send to every remaining seller; True if the broadcast completed"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: set[asyncio.Task] = set()
+
+        async def send_one(seller_id: int, telegram_id: int):
+            try:
+                outcome = await self._send(broadcast, telegram_id)
+            except Exception as e:
+                logger.error(f"Broadcast {broadcast.id} to {telegram_id} failed: {e}")
+                outcome = "failed"
+            finally:
+                semaphore.release()
+            progress.finished(seller_id, outcome)
+            BROADCAST_MESSAGES.inc(outcome)
+
+        completed = False
+        heartbeat = asyncio.create_task(self._heartbeat(progress, asyncio.current_task()))
+        try:
+            async with aclosing(self._sellers(progress.last_seller_id)) as sellers:
+                async for seller_id, telegram_id in sellers:
+                    await semaphore.acquire()
+                    progress.started(seller_id)
+                    task = asyncio.create_task(send_one(seller_id, telegram_id))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    if progress.due(self.checkpoint_every) and not await self._checkpoint(progress):
+                        logger.info(f"Broadcast {broadcast.id} was cancelled or taken over by another process")
+                        return False
+            await asyncio.gather(*tasks)
+            completed = True
+        except asyncio.CancelledError:
+            if not progress.lease_lost:
+                raise
+            asyncio.current_task().uncancel()
+            logger.info(f"Broadcast {broadcast.id} lost its lease, stopping")
+            return False
+        finally:
+            heartbeat.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Release the lease on the way out so a restart resumes right away
+            await self._checkpoint(progress, finished=completed, release=True)
+        return True
+
+    def _chat_limiter(self, chat_id: int) -> AsyncLimiter:
+        limiter = self._chat_limiters.get(chat_id)
+        if limiter is None:
+            limiter = self._chat_limiters[chat_id] = AsyncLimiter(1, 1 / self.chat_rate)
+        return limiter
+
+    async def _send(self, broadcast: Broadcast, chat_id: int) -> str:
+        """Send one message; returns "sent", "failed" or "blocked" """
+        for attempt in range(1, self.max_attempts + 1):
+            # Flood control applies to the whole bot, so a RetryAfter pauses every send
+            while (wait := self._paused_until - time.monotonic()) > 0:
+                await asyncio.sleep(wait)
+            async with self._chat_limiter(chat_id), self.limiter:
+                try:
+                    if broadcast.dry_run:
+                        await asyncio.sleep(self.dry_run_latency)
+                    else:
+                        await self.bot.send_message(chat_id, broadcast.text)
+                    return "sent"
+                except RetryAfter as e:
+                    delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                    logger.warning(f"Broadcast {broadcast.id} hit flood control, pausing {delay}s")
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                except Forbidden:
+                    return "blocked"
+                except BadRequest as e:
+                    logger.warning(f"Broadcast {broadcast.id} to {chat_id} rejected: {e}")
+                    return "failed"
+                except NetworkError as e:
+                    logger.warning(f"Broadcast {broadcast.id} to {chat_id} failed (attempt {attempt}): {e}")
+                    await asyncio.sleep(2 ** (attempt - 1))
+        return "failed"
+
+
+async def _main(args):
+    """Run one broadcast in the foreground and report throughput"""
+    from telegram import Bot
+
+    from db import engine
+
+    broadcaster = Broadcaster(rate=args.rate, dry_run_latency=args.latency)
+    try:
+        if not args.dry_run:
+            # TELEGRAM_API_BASE_URL can point at a local Bot API (bench/fake_bot_api.py)
+            base_url = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+            broadcaster.bot = Bot(str(os.getenv("BOT_TOKEN")), base_url=base_url)
+            await broadcaster.bot.initialize()
+        broadcast_id = await broadcaster.create(args.text, created_by=0, dry_run=args.dry_run)
+        await broadcaster.run(broadcast_id)
+    finally:
+        if broadcaster.bot:
+            await broadcaster.bot.shutdown()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    # python broadcast.py --dry-run --rate 1000 "متن پیام"
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Send a message to every seller")
+    parser.add_argument("text")
+    parser.add_argument("--dry-run", action="store_true", help="go through every step except calling Telegram")
+    parser.add_argument("--rate", type=float, default=GLOBAL_RATE, help="messages per second")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated send latency for dry runs")
+    asyncio.run(_main(parser.parse_args()))
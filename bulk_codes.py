@@ -0,0 +1,133 @@
+import csv
+import io
+import re
+import secrets
+import string
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from code_reservations import code_reservations
+from db import AsyncSessionLocal
+from models import ReferralCode, ReferralCodeProductEnum
+from referral_lookup import RECORD_COLUMNS, CodeRecord, notify_upsert_many
+
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+
+
+class CodeRow(NamedTuple):
+    code: str
+    product: Optional[ReferralCodeProductEnum]
+    installment: bool
+
+
+class RowResult(NamedTuple):
+    code: str
+    created: bool
+    reason: str
+
+
+def is_valid_code(code: str) -> bool:
+    """Check if the code is at least 5 English letters and/or digits"""
+    return bool(re.fullmatch(r"[A-Za-z0-9]{5,32}", code))
+
+
+def generate_codes(prefix: str, count: int, product: ReferralCodeProductEnum,
+                   installment: bool = False, length: int = 6) -> list[CodeRow]:
+    """Generate count distinct codes of the form <prefix><random suffix>"""
+    codes: set[str] = set()
+    while len(codes) < count:
+        codes.add(prefix + "".join(secrets.choice(CODE_ALPHABET) for _ in range(length)))
+    return [CodeRow(code, product, installment) for code in sorted(codes)]
+
+
+def parse_csv(data: bytes, product_map: dict) -> list[CodeRow]:
+    """Parse uploaded rows of code,product[,installment].
+
+    product may be an enum value ("almas", "5", ...) or one of the Persian
+    labels in product_map; installment is "قسطی", "1", "true" or "yes".
+    A header row is skipped if present.
+    """
+    text = data.decode("utf-8-sig")
+    rows = []
+    for record in csv.reader(io.StringIO(text)):
+        if not record or not record[0].strip():
+            continue
+        code = record[0].strip()
+        if code.lower() == "code":
+            continue
+        product_text = record[1].strip() if len(record) > 1 else ""
+        product = product_map.get(product_text)
+        if product is None:
+            try:
+                product = ReferralCodeProductEnum(product_text.lower())
+            except ValueError:
+                product = None
+        installment = len(record) > 2 and record[2].strip().lower() in ("قسطی", "1", "true", "yes")
+        rows.append(CodeRow(code, product, installment))
+    return rows
+
+
+async def create_codes(owner_id: int, rows: list[CodeRow]) -> tuple[list[RowResult], list[CodeRecord]]:
+    """Insert a batch of codes for a seller in one transaction.
+
+    Rows are validated locally, collisions are found with a single set
+    query, and the rest go in as one multi-row insert. Returns a result per
+    input row plus the records that were created.
+    """
+    results: dict[int, RowResult] = {}
+    candidates: dict[str, int] = {}
+    for index, row in enumerate(rows):
+        if not is_valid_code(row.code):
+            results[index] = RowResult(row.code, False, "invalid format")
+        elif row.product is None:
+            results[index] = RowResult(row.code, False, "unknown product")
+        elif row.installment and row.product != ReferralCodeProductEnum.ALMAS:
+            results[index] = RowResult(row.code, False, "installment is only for almas")
+        elif row.code in candidates:
+            results[index] = RowResult(row.code, False, "duplicate in batch")
+        else:
+            candidates[row.code] = index
+
+    created: list[CodeRecord] = []
+    if candidates:
+        async with AsyncSessionLocal() as session:
+            taken = await session.execute(select(ReferralCode.code).where(ReferralCode.code.in_(candidates)))
+            for code in taken.scalars():
+                results[candidates.pop(code)] = RowResult(code, False, "already exists")
+            if candidates:
+                # Held by a seller who is in the middle of /add_code
+                for code in await code_reservations.held(session, list(candidates)):
+                    results[candidates.pop(code)] = RowResult(code, False, "reserved")
+
+            if candidates:
+                values = [
+                    {"code": code, "product": rows[index].product, "installment": rows[index].installment,
+                     "discount": 0, "owner_id": owner_id}
+                    for code, index in candidates.items()
+                ]
+                # Codes taken by a concurrent insert since the check above are skipped, not fatal
+                stmt = insert(ReferralCode).on_conflict_do_nothing(index_elements=[ReferralCode.code]).returning(*RECORD_COLUMNS)
+                result = await session.execute(stmt, values)
+                created = [CodeRecord(*row) for row in result.all()]
+                await notify_upsert_many(session, created)
+            await session.commit()
+
+    created_codes = {record.code for record in created}
+    for code, index in candidates.items():
+        if code in created_codes:
+            results[index] = RowResult(code, True, "")
+        else:
+            results[index] = RowResult(code, False, "already exists")
+    return [results[index] for index in range(len(rows))], created
+
+
+def report_csv(results: list[RowResult]) -> io.BytesIO:
+    """Build a code,status,reason CSV report"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["code", "status", "reason"])
+    for result in results:
+        writer.writerow([result.code, "created" if result.created else "rejected", result.reason])
+    return io.BytesIO(buffer.getvalue().encode("utf-8-sig"))
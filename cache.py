@@ -0,0 +1,106 @@
+import os
+from typing import NamedTuple, Optional
+
+from cachetools import TTLCache
+
+from db import AsyncSessionLocal
+from queries import SELLER_BY_TELEGRAM_ID
+
+
+class SellerProfile(NamedTuple):
+    id: int
+    telegram_id: int
+    name: str
+    number: str
+
+
+class SellerCache:
+    """Bounded LRU/TTL cache of telegram_id -> SellerProfile.
+
+    Only registered sellers are cached; unknown users always go to the
+    database so a fresh registration is seen immediately. Call invalidate()
+    whenever a seller row is created or updated.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, telegram_id: int) -> Optional[SellerProfile]:
+        profile = self._cache.get(telegram_id)
+        if profile is not None:
+            self.hits += 1
+            return profile
+
+        self.misses += 1
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(SELLER_BY_TELEGRAM_ID, {"telegram_id": telegram_id})
+            row = result.one_or_none()
+        if row is None:
+            return None
+        profile = SellerProfile(*row)
+        self._cache[telegram_id] = profile
+        return profile
+
+    def invalidate(self, telegram_id: int):
+        self._cache.pop(telegram_id, None)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+seller_cache = SellerCache(
+    maxsize=int(os.getenv("SELLER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SELLER_CACHE_TTL", "600")),
+)
+
+
+class CodePage(NamedTuple):
+    rows: list  # [(id, code), ...] in id order
+    has_prev: bool
+    has_next: bool
+
+
+class CodePageCache:
+    """Per-seller cache of /list_codes pages.
+
+    Pages are keyed by their keyset cursor. Any add or delete for a seller
+    drops all of that seller's pages, in other processes through the
+    referral code notifications.
+    """
+
+    def __init__(self, maxsize: int = 5000, ttl: float = 300, pages_per_owner: int = 50):
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.pages_per_owner = pages_per_owner
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, owner_id: int, cursor: tuple) -> Optional[CodePage]:
+        page = self._cache.get(owner_id, {}).get(cursor)
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return page
+
+    def put(self, owner_id: int, cursor: tuple, page: CodePage):
+        pages = self._cache.get(owner_id)
+        if pages is None or len(pages) >= self.pages_per_owner:
+            pages = self._cache[owner_id] = {}
+        pages[cursor] = page
+
+    def invalidate(self, owner_id: int):
+        self._cache.pop(owner_id, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+code_page_cache = CodePageCache(
+    maxsize=int(os.getenv("CODE_PAGE_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("CODE_PAGE_CACHE_TTL", "300")),
+)
@@ -0,0 +1,79 @@
+import os
+from datetime import timedelta
+
+from sqlalchemy import BigInteger, String, delete, exists, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+
+from db import AsyncSessionLocal
+from models import CodeReservation, ReferralCode
+
+
+class CodeReservations:
+    """Short-lived holds on referral codes while a seller finishes /add_code.
+
+    reserve() claims a code that is neither taken nor held by someone else
+    in one INSERT ... ON CONFLICT, so two sellers typing the same code at
+    once cannot both get it. The hold is consumed in the transaction that
+    inserts the code. An expired hold can be claimed by anyone; until then
+    only its owner can use it.
+    """
+
+    def __init__(self, ttl: int = 900):
+        self.ttl = ttl
+
+    async def reserve(self, code: str, telegram_id: int) -> bool:
+        """Hold a code for a user; False if it exists or someone else holds it"""
+        expires_at = func.now() + timedelta(seconds=self.ttl)
+        free = (
+            select(literal(code, String), literal(telegram_id, BigInteger), expires_at, func.now())
+            .where(~exists().where(ReferralCode.code == code))
+        )
+        stmt = insert(CodeReservation).from_select(["code", "telegram_id", "expires_at", "created_at"], free)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CodeReservation.code],
+            set_={"telegram_id": stmt.excluded.telegram_id, "expires_at": stmt.excluded.expires_at,
+                  "created_at": stmt.excluded.created_at},
+            where=(CodeReservation.expires_at <= func.now()) | (CodeReservation.telegram_id == telegram_id),
+        ).returning(CodeReservation.code)
+        async with AsyncSessionLocal() as session:
+            # One hold per user: choosing another code frees the previous one
+            await session.execute(
+                delete(CodeReservation).where(CodeReservation.telegram_id == telegram_id, CodeReservation.code != code)
+            )
+            result = await session.execute(stmt)
+            reserved = result.scalar_one_or_none() is not None
+            await session.commit()
+        return reserved
+
+    async def consume(self, session, code: str, telegram_id: int) -> bool:
+        """Drop a user's hold as part of the caller's transaction; False if it was lost.
+
+        An expired hold still counts as long as nobody else claimed the code.
+        """
+        result = await session.execute(
+            delete(CodeReservation)
+            .where(CodeReservation.code == code, CodeReservation.telegram_id == telegram_id)
+            .returning(CodeReservation.code)
+        )
+        return result.scalar_one_or_none() is not None
+
+    async def release(self, telegram_id: int):
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(CodeReservation).where(CodeReservation.telegram_id == telegram_id))
+            await session.commit()
+
+    async def held(self, session, codes: list[str]) -> set[str]:
+        """Codes from the list that are on hold right now"""
+        result = await session.execute(
+            select(CodeReservation.code).where(CodeReservation.code.in_(codes), CodeReservation.expires_at > func.now())
+        )
+        return set(result.scalars())
+
+    async def purge(self):
+        """Delete holds that have expired"""
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(CodeReservation).where(CodeReservation.expires_at <= func.now()))
+            await session.commit()
+
+
+code_reservations = CodeReservations(ttl=int(os.getenv("CODE_RESERVATION_TTL", "900")))
@@ -1,5 +1,15 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import asyncio
+import logging
 import os
+import time
+
+from metrics import DB_POOL_WAIT, DB_QUERY_ERRORS, DB_QUERY_LATENCY, registry
+
+logger = logging.getLogger(__name__)
 
 # Use environment variable for database URL with fallback
 DB_URL = os.getenv(
@@ -11,5 +21,140 @@ DB_URL = os.getenv(
 if not DB_URL.startswith("postgresql+asyncpg://"):
     DB_URL = DB_URL.replace("postgresql://", "postgresql+asyncpg://")
 
-engine = create_async_engine(DB_URL, echo=False)
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+
+def _statement_kind(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    DB_QUERY_LATENCY.observe(time.perf_counter() - conn.info["query_start"].pop(), _statement_kind(statement))
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+    DB_QUERY_ERRORS.inc(_statement_kind(context.statement or ""))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+def create_engine_from_env(url: str = DB_URL) -> AsyncEngine:
+    """Create the async engine with pool and statement cache settings from the environment.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds to wait for a
+    connection), DB_POOL_RECYCLE (seconds before a connection is replaced),
+    DB_POOL_PRE_PING and DB_STATEMENT_CACHE_SIZE (prepared statements kept
+    per connection; set it to 0 behind pgbouncer in transaction mode).
+    """
+    statement_cache_size = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        url = url.update_query_dict({"prepared_statement_cache_size": str(statement_cache_size)})
+        connect_args = {
+            "statement_cache_size": statement_cache_size,
+            "server_settings": {"application_name": os.getenv("DB_APPLICATION_NAME", "sellersbot")},
+        }
+    else:
+        connect_args = {}
+
+    new_engine = create_async_engine(
+        url,
+        echo=False,
+        poolclass=TimedQueuePool,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=_env_bool("DB_POOL_PRE_PING", True),
+        connect_args=connect_args,
+    )
+    event.listen(new_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(new_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(new_engine.sync_engine, "handle_error", _handle_error)
+    return new_engine
+
+
+engine = create_engine_from_env()
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+
+def pool_stats() -> dict:
+    """Current pool usage; saturation is checked out connections over the pool's hard limit"""
+    pool = engine.pool
+    limit = pool.size() + max(pool._max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "saturation": checked_out / limit if limit else 0.0,
+    }
+
+
+async def warm_up(queries: list = (), connections: int | None = None):
+    """Open pooled connections ahead of traffic and prepare the hot queries on each.
+
+    Every connection runs SELECT 1 and each (statement, params) pair in
+    queries, so the first real requests after a deploy find connected
+    sockets, compiled SQL and server-side prepared statements waiting.
+    """
+    if connections is None:
+        connections = int(os.getenv("DB_WARMUP_CONNECTIONS", str(engine.pool.size())))
+    connections = min(connections, engine.pool.size())
+    start = time.perf_counter()
+
+    ready = asyncio.Event()
+    settled = 0
+
+    def settle():
+        nonlocal settled
+        settled += 1
+        if settled == connections:
+            ready.set()
+
+    async def prepare():
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+                for statement, params in queries:
+                    await connection.execute(statement, params)
+                # Hold the connection until all are open, or the pool would hand the same one back
+                settle()
+                await ready.wait()
+        except Exception:
+            if not ready.is_set():
+                settle()
+            raise
+
+    results = await asyncio.gather(*(prepare() for _ in range(connections)), return_exceptions=True)
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        logger.warning(f"Database warm-up: {len(failures)} of {connections} connections failed: {failures[0]}")
+    logger.info(f"Database warm-up opened {connections - len(failures)} connections "
+                f"and prepared {len(queries)} queries in {time.perf_counter() - start:.3f}s")
+
+
+registry.gauge("bot_db_pool_size", "Configured pool size", lambda: engine.pool.size())
+registry.gauge("bot_db_pool_checked_out", "Connections currently checked out", lambda: engine.pool.checkedout())
+registry.gauge("bot_db_pool_overflow", "Connections open beyond the pool size", lambda: engine.pool.overflow())
+registry.gauge("bot_db_pool_saturation", "Checked out connections over pool size plus overflow",
+               lambda: pool_stats()["saturation"])
@@ -0,0 +1,127 @@
+import asyncio
+import csv
+import io
+import os
+from datetime import datetime
+from enum import Enum
+from tempfile import SpooledTemporaryFile
+
+from sqlalchemy import select
+
+from db import AsyncSessionLocal
+from models import Order, Product, ReferralCode
+
+# Files up to this size stay in memory, bigger ones roll over to disk
+SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", str(1024 * 1024)))
+# Rows fetched per round trip from the server-side cursor
+BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Telegram rejects documents larger than this from bots
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+EXPORTS = {
+    "orders": (
+        ["id", "product", "status", "final_price", "discount", "installment",
+         "first_installment", "second_installment", "third_installment", "created_at", "approved_at"],
+        lambda seller_id: (
+            select(Order.id, Product.name, Order.status, Order.final_price, Order.discount, Order.installment,
+                   Order.first_installment, Order.second_installment, Order.third_installment,
+                   Order.created_at, Order.approved_at)
+            .join(Product, Product.id == Order.product_id)
+            .where(Order.seller_id == seller_id)
+            .order_by(Order.id)
+        ),
+    ),
+    "codes": (
+        ["code", "product", "installment", "discount", "created_at"],
+        lambda seller_id: (
+            select(ReferralCode.code, ReferralCode.product, ReferralCode.installment,
+                   ReferralCode.discount, ReferralCode.created_at)
+            .where(ReferralCode.owner_id == seller_id)
+            .order_by(ReferralCode.id)
+        ),
+    ),
+}
+FORMATS = ("csv", "xlsx")
+
+
+class ExportTooLarge(Exception):
+    """Raised when an export is bigger than Telegram lets a bot upload"""
+
+
+def _cell(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0)
+    return value
+
+
+async def _rows(kind: str, seller_id: int):
+    """Yield a seller's export rows from a server-side cursor, BATCH_SIZE at a time"""
+    _, query = EXPORTS[kind]
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(query(seller_id).execution_options(yield_per=BATCH_SIZE))
+        async for partition in result.partitions():
+            yield [[_cell(value) for value in row] for row in partition]
+
+
+async def _write_csv(kind: str, seller_id: int, output) -> int:
+    header, _ = EXPORTS[kind]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    count = 0
+    # utf-8-sig so Excel opens the Persian product names correctly
+    output.write(buffer.getvalue().encode("utf-8-sig"))
+    async for rows in _rows(kind, seller_id):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        output.write(buffer.getvalue().encode("utf-8"))
+        count += len(rows)
+        if output.tell() > MAX_UPLOAD_SIZE:
+            raise ExportTooLarge(kind)
+    return count
+
+
+def _append_rows(sheet, rows: list):
+    for row in rows:
+        sheet.append(row)
+
+
+async def _write_xlsx(kind: str, seller_id: int, output) -> int:
+    # Optional dependency, only needed for spreadsheet exports
+    from openpyxl import Workbook
+
+    header, _ = EXPORTS[kind]
+    # Write-only workbooks keep finished rows out of memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(kind)
+    sheet.append(header)
+    count = 0
+    # Encoding cells is CPU heavy, so keep it off the event loop
+    async for rows in _rows(kind, seller_id):
+        await asyncio.to_thread(_append_rows, sheet, rows)
+        count += len(rows)
+    await asyncio.to_thread(workbook.save, output)
+    if output.tell() > MAX_UPLOAD_SIZE:
+        raise ExportTooLarge(kind)
+    return count
+
+
+async def export_seller(kind: str, seller_id: int, fmt: str = "csv") -> tuple[SpooledTemporaryFile, int]:
+    """Encode a seller's orders or codes into a spooled temporary file.
+
+    Returns the file, rewound, and the number of rows. The caller closes it.
+    """
+    output = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        if fmt == "xlsx":
+            count = await _write_xlsx(kind, seller_id, output)
+        else:
+            count = await _write_csv(kind, seller_id, output)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    return output, count
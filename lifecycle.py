@@ -0,0 +1,50 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    """Startup timing and readiness of the bot process.
+
+    The process reports ready once post_init has finished. It stops
+    reporting ready the moment a stop signal arrives, so load balancers
+    send new updates to other replicas while this one drains.
+    """
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at  # time.perf_counter() as early in the process as possible
+        self.startup_seconds: Optional[float] = None
+        self.ready = False
+        self.draining = False
+        self._drain_started: Optional[float] = None
+        self._phases: list[tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time one startup step for the startup log line"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases.append((name, time.perf_counter() - start))
+
+    def mark_ready(self):
+        self.startup_seconds = time.perf_counter() - self.started_at
+        self.ready = True
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self._phases)
+        logger.info(f"Ready in {self.startup_seconds:.2f}s ({phases})")
+
+    def begin_drain(self, in_flight: int):
+        if self.draining:
+            return
+        self.draining = True
+        self.ready = False
+        self._drain_started = time.perf_counter()
+        logger.info(f"Stop signal received, draining {in_flight} updates in flight")
+
+    def drained(self):
+        if self._drain_started is not None:
+            logger.info(f"Drained in {time.perf_counter() - self._drain_started:.2f}s")
@@ -0,0 +1,239 @@
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Gauge:
+    """A gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            lines.append(f"{self.name} {float(self.callback())}")
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} failed: {e}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts..., +Inf count], sum
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, *labelvalues):
+        counts = self._counts.get(labelvalues)
+        if counts is None:
+            counts = self._counts[labelvalues] = [0] * (len(self.buckets) + 1)
+            self._sums[labelvalues] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labelvalues] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def count(self, *labelvalues) -> int:
+        return sum(self._counts.get(labelvalues, ()))
+
+    def total_count(self) -> int:
+        """Observations across all label values"""
+        return sum(sum(counts) for counts in self._counts.values())
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labelvalues, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labelvalues, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {self._sums[labelvalues]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, documentation: str, callback: Callable[[], float]):
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HANDLER_LATENCY = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Time spent in each update handler", ("handler", "outcome")))
+DB_QUERY_LATENCY = registry.register(Histogram(
+    "bot_db_query_duration_seconds", "Time spent executing SQL statements", ("statement",)))
+DB_QUERY_ERRORS = registry.register(Counter(
+    "bot_db_query_errors_total", "SQL statements that raised", ("statement",)))
+DB_POOL_WAIT = registry.register(Histogram(
+    "bot_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection"))
+SMS_LATENCY = registry.register(Histogram(
+    "bot_sms_send_duration_seconds", "Time spent in SMS provider calls", ("provider", "outcome")))
+BROADCAST_MESSAGES = registry.register(Counter(
+    "bot_broadcast_messages_total", "Broadcast messages by outcome", ("outcome",)))
+
+
+def instrument_callback(callback: Callable[..., Awaitable], name: Optional[str] = None):
+    """Wrap a PTB handler callback so its latency is recorded"""
+    if getattr(callback, "__instrumented__", False):
+        return callback
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, name, outcome)
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_application(app):
+    """Wrap the callback of every handler registered on the application"""
+    from telegram.ext import ConversationHandler
+
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for child in handler.entry_points + handler.fallbacks:
+                wrap(child)
+            for state_handlers in handler.states.values():
+                for child in state_handlers:
+                    wrap(child)
+        elif hasattr(handler, "callback"):
+            handler.callback = instrument_callback(handler.callback)
+
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+
+class MetricsServer:
+    """Minimal HTTP server for /metrics (Prometheus text), /healthz and /ready"""
+
+    def __init__(self, host: str, port: int, readiness_check: Optional[Callable[[], Awaitable[bool]]] = None):
+        self.host = host
+        self.port = port
+        self.readiness_check = readiness_check
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain headers; we only route on the path
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else "/"
+
+            if path == "/metrics":
+                status, body = 200, registry.render()
+                content_type = "text/plain; version=0.0.4"
+            elif path == "/healthz":
+                status, body, content_type = 200, "ok\n", "text/plain"
+            elif path == "/ready":
+                ready = await self._is_ready()
+                status, body, content_type = (200, "ready\n", "text/plain") if ready else (503, "not ready\n", "text/plain")
+            else:
+                status, body, content_type = 404, "not found\n", "text/plain"
+
+            payload = body.encode()
+            reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}[status]
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _is_ready(self) -> bool:
+        if self.readiness_check is None:
+            return True
+        try:
+            return await asyncio.wait_for(self.readiness_check(), timeout=3)
+        except Exception as e:
+            logger.warning(f"Readiness check failed: {e}")
+            return False
@@ -0,0 +1,74 @@
+import time
+from logging.config import fileConfig
+
+from sqlalchemy import engine_from_config, pool, text
+
+from alembic import context
+
+from db import DB_URL
+from models import Base
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+# Alembic runs synchronously, so use psycopg2 instead of asyncpg
+config.set_main_option("sqlalchemy.url", DB_URL.replace("postgresql+asyncpg://", "postgresql+psycopg2://"))
+
+target_metadata = Base.metadata
+
+# The database is shared with the customer bot, which keeps its own
+# alembic_version table; track this bot's migrations separately.
+VERSION_TABLE = "alembic_version_sellersbot"
+# Serializes concurrent `alembic upgrade` runs (several containers starting
+# at once); the second one waits, then finds the database already upgraded
+MIGRATION_LOCK = "sellersbot_migrations"
+
+
+def run_migrations_offline():
+    context.configure(
+        url=config.get_main_option("sqlalchemy.url"),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        version_table=VERSION_TABLE,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connectable = engine_from_config(
+        config.get_section(config.config_ini_section, {}),
+        prefix="sqlalchemy.",
+        poolclass=pool.NullPool,
+    )
+
+    with connectable.connect() as connection:
+        # Session-level lock, taken before alembic reads the current version. Polled in
+        # short transactions: a waiter blocked in pg_advisory_lock would keep a
+        # transaction open, which CREATE INDEX CONCURRENTLY in the holder waits on
+        while not connection.scalar(text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": MIGRATION_LOCK}):
+            connection.commit()
+            time.sleep(1)
+        connection.commit()
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            version_table=VERSION_TABLE,
+        )
+
+        try:
+            with context.begin_transaction():
+                context.run_migrations()
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": MIGRATION_LOCK})
+            connection.commit()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,146 @@
+"""seller sales rollups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+ROLLUP_TABLES = ("seller_sales_totals", "seller_product_sales", "seller_daily_sales")
+
+
+def rollup_columns():
+    return [
+        sa.Column("status", postgresql.ENUM(name="orderstatusenum", create_type=False), primary_key=True),
+        sa.Column("order_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("revenue", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("discount_total", sa.BigInteger(), nullable=False, server_default="0"),
+    ]
+
+
+def upgrade():
+    op.create_table(
+        "seller_sales_totals",
+        sa.Column("seller_id", sa.Integer(), sa.ForeignKey("sellers.id"), primary_key=True),
+        *rollup_columns(),
+    )
+    op.create_table(
+        "seller_product_sales",
+        sa.Column("seller_id", sa.Integer(), sa.ForeignKey("sellers.id"), primary_key=True),
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), primary_key=True),
+        *rollup_columns(),
+    )
+    op.create_table(
+        "seller_daily_sales",
+        sa.Column("seller_id", sa.Integer(), sa.ForeignKey("sellers.id"), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        *rollup_columns(),
+    )
+
+    # Add (or with negative deltas, remove) one order's contribution to every rollup
+    op.execute("""
+        CREATE OR REPLACE FUNCTION seller_sales_apply(
+            p_seller_id integer, p_product_id integer, p_day date, p_status orderstatusenum,
+            p_count integer, p_revenue bigint, p_discount bigint
+        ) RETURNS void AS $$
+        BEGIN
+            INSERT INTO seller_sales_totals AS t (seller_id, status, order_count, revenue, discount_total)
+            VALUES (p_seller_id, p_status, p_count, p_revenue, p_discount)
+            ON CONFLICT (seller_id, status) DO UPDATE SET
+                order_count = t.order_count + EXCLUDED.order_count,
+                revenue = t.revenue + EXCLUDED.revenue,
+                discount_total = t.discount_total + EXCLUDED.discount_total;
+
+            INSERT INTO seller_product_sales AS t (seller_id, product_id, status, order_count, revenue, discount_total)
+            VALUES (p_seller_id, p_product_id, p_status, p_count, p_revenue, p_discount)
+            ON CONFLICT (seller_id, product_id, status) DO UPDATE SET
+                order_count = t.order_count + EXCLUDED.order_count,
+                revenue = t.revenue + EXCLUDED.revenue,
+                discount_total = t.discount_total + EXCLUDED.discount_total;
+
+            INSERT INTO seller_daily_sales AS t (seller_id, day, status, order_count, revenue, discount_total)
+            VALUES (p_seller_id, p_day, p_status, p_count, p_revenue, p_discount)
+            ON CONFLICT (seller_id, day, status) DO UPDATE SET
+                order_count = t.order_count + EXCLUDED.order_count,
+                revenue = t.revenue + EXCLUDED.revenue,
+                discount_total = t.discount_total + EXCLUDED.discount_total;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION seller_sales_rollup() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.seller_id IS NOT NULL THEN
+                PERFORM seller_sales_apply(
+                    OLD.seller_id, OLD.product_id, COALESCE(OLD.created_at, now())::date, OLD.status,
+                    -1, -OLD.final_price::bigint, -COALESCE(OLD.discount, 0)::bigint
+                );
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.seller_id IS NOT NULL THEN
+                PERFORM seller_sales_apply(
+                    NEW.seller_id, NEW.product_id, COALESCE(NEW.created_at, now())::date, NEW.status,
+                    1, NEW.final_price::bigint, COALESCE(NEW.discount, 0)::bigint
+                );
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE TRIGGER orders_seller_sales_rollup
+        AFTER INSERT OR DELETE OR UPDATE OF seller_id, product_id, status, final_price, discount, created_at
+        ON orders
+        FOR EACH ROW EXECUTE FUNCTION seller_sales_rollup();
+    """)
+
+    # Full recomputation from orders; used for the backfill below and by `python stats.py rebuild`
+    op.execute("""
+        CREATE OR REPLACE FUNCTION seller_sales_rebuild() RETURNS void AS $$
+        BEGIN
+            -- Block order writes (not reads) so the trigger cannot race the recomputation
+            LOCK TABLE orders IN SHARE MODE;
+
+            DELETE FROM seller_sales_totals;
+            DELETE FROM seller_product_sales;
+            DELETE FROM seller_daily_sales;
+
+            INSERT INTO seller_sales_totals (seller_id, status, order_count, revenue, discount_total)
+            SELECT seller_id, status, count(*), sum(final_price), sum(COALESCE(discount, 0))
+            FROM orders WHERE seller_id IS NOT NULL
+            GROUP BY seller_id, status;
+
+            INSERT INTO seller_product_sales (seller_id, product_id, status, order_count, revenue, discount_total)
+            SELECT seller_id, product_id, status, count(*), sum(final_price), sum(COALESCE(discount, 0))
+            FROM orders WHERE seller_id IS NOT NULL
+            GROUP BY seller_id, product_id, status;
+
+            INSERT INTO seller_daily_sales (seller_id, day, status, order_count, revenue, discount_total)
+            SELECT seller_id, COALESCE(created_at, now())::date, status, count(*), sum(final_price), sum(COALESCE(discount, 0))
+            FROM orders WHERE seller_id IS NOT NULL
+            GROUP BY seller_id, COALESCE(created_at, now())::date, status;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("SELECT seller_sales_rebuild()")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS orders_seller_sales_rollup ON orders")
+    op.execute("DROP FUNCTION IF EXISTS seller_sales_rebuild()")
+    op.execute("DROP FUNCTION IF EXISTS seller_sales_rollup()")
+    op.execute("DROP FUNCTION IF EXISTS seller_sales_apply(integer, integer, date, orderstatusenum, integer, bigint, bigint)")
+    for table in reversed(ROLLUP_TABLES):
+        op.drop_table(table)
@@ -0,0 +1,42 @@
+"""access path indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16 15:00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# name, table, columns, included columns
+INDEXES = [
+    # Keyset pages of a seller's codes: WHERE owner_id = ? AND id > ? ORDER BY id, answered from the index alone
+    ("ix_referral_codes_owner_id_id", "referral_codes", ["owner_id", "id"], ["code"]),
+    # A seller's orders by status and date; also covers the seller_id foreign key
+    ("ix_orders_seller_id_status_created_at", "orders", ["seller_id", "status", "created_at"], []),
+]
+
+
+def upgrade():
+    # referral_codes and orders are live tables shared with the customer
+    # bot, so build without blocking writes (needs to run outside a transaction)
+    with op.get_context().autocommit_block():
+        for name, table, columns, include in INDEXES:
+            op.create_index(
+                name, table, columns,
+                postgresql_include=include,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
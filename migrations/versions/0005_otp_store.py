@@ -0,0 +1,41 @@
+"""otp store
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-16 19:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "otp_codes",
+        sa.Column("telegram_id", sa.BigInteger(), primary_key=True, autoincrement=False),
+        sa.Column("phone", sa.String(), nullable=False),
+        sa.Column("code_hash", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_table(
+        "otp_sends",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("sent_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_otp_sends_key_sent_at", "otp_sends", ["key", "sent_at"])
+
+
+def downgrade():
+    op.drop_index("ix_otp_sends_key_sent_at", table_name="otp_sends")
+    op.drop_table("otp_sends")
+    op.drop_table("otp_codes")
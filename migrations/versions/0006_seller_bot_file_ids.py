@@ -0,0 +1,27 @@
+"""seller bot file ids
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-16 20:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # files.file_id belongs to the customer bot and a file_id only works for
+    # the bot that received it, so the seller bot caches its own next to it.
+    # Nullable without a default, so adding it does not rewrite the table.
+    op.add_column("files", sa.Column("seller_bot_file_id", sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("files", "seller_bot_file_id")
@@ -0,0 +1,32 @@
+"""code reservations
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-16 21:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "code_reservations",
+        sa.Column("code", sa.String(), primary_key=True),
+        sa.Column("telegram_id", sa.BigInteger(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_code_reservations_telegram_id", "code_reservations", ["telegram_id"])
+
+
+def downgrade():
+    op.drop_index("ix_code_reservations_telegram_id", table_name="code_reservations")
+    op.drop_table("code_reservations")
@@ -0,0 +1,46 @@
+"""scheduled jobs
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-16 22:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+# Partial indexes for installment reminders, one per due date column. status
+# leads so the scan of approved orders is a single range ordered by (date, id)
+INSTALLMENT_COLUMNS = ["first_installment", "second_installment", "third_installment"]
+
+
+def upgrade():
+    op.create_table(
+        "job_runs",
+        sa.Column("job", sa.String(), primary_key=True),
+        sa.Column("run_key", sa.String(), primary_key=True),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    # orders is shared with the customer bot, so build without blocking writes
+    with op.get_context().autocommit_block():
+        for column in INSTALLMENT_COLUMNS:
+            op.create_index(
+                f"ix_orders_status_{column}_id", "orders", ["status", column, "id"],
+                postgresql_where=sa.text(f"{column} IS NOT NULL"),
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for column in reversed(INSTALLMENT_COLUMNS):
+            op.drop_index(f"ix_orders_status_{column}_id", table_name="orders", postgresql_concurrently=True, if_exists=True)
+    op.drop_table("job_runs")
@@ -0,0 +1,26 @@
+"""broadcast lease owner
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Token of the claim that holds the lease, so a process whose lease was
+    # taken over can tell and stop writing progress
+    op.add_column("broadcasts", sa.Column("lease_owner", sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("broadcasts", "lease_owner")
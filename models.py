@@ -1,5 +1,5 @@
 from random import choice
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Table, Text, BigInteger
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, ForeignKey, Index, Table, Text, BigInteger, JSON
 from datetime import date, datetime
 from sqlalchemy.orm import ONETOMANY, relationship, declarative_base
 from sqlalchemy.types import Enum as SqlEnum
@@ -88,6 +88,14 @@ class Order(Base):
     approved_at = Column(DateTime, default=datetime.now)
     receipts = relationship("File", secondary="order_receipts", back_populates="orders")
 
+    __table_args__ = (
+        Index("ix_orders_seller_id_status_created_at", "seller_id", "status", "created_at"),
+        # Installment reminders scan each due date column of approved orders by (date, id); most orders have none
+        Index("ix_orders_status_first_installment_id", "status", "first_installment", "id", postgresql_where=first_installment.isnot(None)),
+        Index("ix_orders_status_second_installment_id", "status", "second_installment", "id", postgresql_where=second_installment.isnot(None)),
+        Index("ix_orders_status_third_installment_id", "status", "third_installment", "id", postgresql_where=third_installment.isnot(None)),
+    )
+
 class Seller(Base):
     __tablename__ = "sellers"
 
@@ -110,12 +118,18 @@ class ReferralCode(Base):
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now)
 
+    __table_args__ = (
+        Index("ix_referral_codes_owner_id_id", "owner_id", "id", postgresql_include=["code"]),
+    )
+
 class File(Base):
     __tablename__ = "files"
 
     id = Column(Integer, primary_key=True)
     file_id = Column(String, nullable=False)
     path = Column(String, nullable=False)
+    # file_id is the customer bot's; this bot's own id for the same file, set on first send
+    seller_bot_file_id = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.now)
     orders = relationship("Order", secondary="order_receipts", back_populates="receipts")
 
@@ -155,4 +169,113 @@ class Cooperation(Base):
     phone_number = Column(String, nullable=False)
     city = Column(String, nullable=False)
     resume_text = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.now)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.now)
+
+class BotConversation(Base):
+    __tablename__ = "bot_conversations"
+
+    name = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    state = Column(JSON, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class BotUserData(Base):
+    __tablename__ = "bot_user_data"
+
+    user_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    data = Column(JSON, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now)
+
+# Sales rollups, maintained by the seller_sales_rollup trigger on orders
+# (see migrations/versions/0002_seller_sales_rollups.py)
+
+class SellerSalesTotal(Base):
+    __tablename__ = "seller_sales_totals"
+
+    seller_id = Column(Integer, ForeignKey("sellers.id"), primary_key=True)
+    status = Column(SqlEnum(OrderStatusEnum), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(BigInteger, nullable=False, default=0)
+    discount_total = Column(BigInteger, nullable=False, default=0)
+
+class SellerProductSales(Base):
+    __tablename__ = "seller_product_sales"
+
+    seller_id = Column(Integer, ForeignKey("sellers.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    status = Column(SqlEnum(OrderStatusEnum), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(BigInteger, nullable=False, default=0)
+    discount_total = Column(BigInteger, nullable=False, default=0)
+
+class SellerDailySales(Base):
+    __tablename__ = "seller_daily_sales"
+
+    seller_id = Column(Integer, ForeignKey("sellers.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    status = Column(SqlEnum(OrderStatusEnum), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(BigInteger, nullable=False, default=0)
+    discount_total = Column(BigInteger, nullable=False, default=0)
+
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    created_by = Column(BigInteger, nullable=False)
+    dry_run = Column(Boolean, nullable=False, default=False)
+    status = Column(String, nullable=False, default="running")  # running, done, cancelled
+    # Checkpoint: every seller with id <= last_seller_id has been handled
+    last_seller_id = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    # The process sending this broadcast renews the lease from a heartbeat and with each checkpoint
+    lease_until = Column(DateTime, nullable=True)
+    # Token of the claim holding the lease; progress is only saved by its holder
+    lease_owner = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+
+class OtpCode(Base):
+    __tablename__ = "otp_codes"
+
+    telegram_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    phone = Column(String, nullable=False)
+    code_hash = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+class OtpSend(Base):
+    __tablename__ = "otp_sends"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False)  # "phone:<number>" or "user:<telegram id>"
+    sent_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_otp_sends_key_sent_at", "key", "sent_at"),
+    )
+
+class CodeReservation(Base):
+    __tablename__ = "code_reservations"
+
+    code = Column(String, primary_key=True)
+    telegram_id = Column(BigInteger, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_code_reservations_telegram_id", "telegram_id"),
+    )
+
+class JobRun(Base):
+    __tablename__ = "job_runs"
+
+    job = Column(String, primary_key=True)
+    run_key = Column(String, primary_key=True)  # e.g. the date of a daily run
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,272 @@
+import hashlib
+import heapq
+import hmac
+import os
+import secrets
+import time
+from collections import deque
+from datetime import timedelta
+from enum import Enum
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+
+from db import AsyncSessionLocal
+from models import OtpCode, OtpSend
+
+
+class OtpCheck(Enum):
+    OK = "ok"
+    WRONG = "wrong"
+    EXPIRED = "expired"  # also returned when no code was issued
+    TOO_MANY_ATTEMPTS = "too_many_attempts"
+
+
+class IssueResult(NamedTuple):
+    code: Optional[str]  # None when throttled
+    retry_after: int  # seconds until another code may be sent
+
+
+class VerifyResult(NamedTuple):
+    check: OtpCheck
+    attempts_left: int
+
+
+def _hash(telegram_id: int, code: str) -> str:
+    return hashlib.sha256(f"{telegram_id}:{code}".encode()).hexdigest()
+
+
+class OtpPolicy:
+    """Expiry, attempt and send limits shared by the OTP stores.
+
+    A code lives for ttl seconds and allows max_attempts guesses. Sends are
+    throttled separately per phone number and per Telegram user: at least
+    resend_interval seconds apart and at most max_sends per send_window.
+    """
+
+    def __init__(self, ttl: int = 120, max_attempts: int = 5, resend_interval: int = 60,
+                 max_sends: int = 5, send_window: int = 3600):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.resend_interval = resend_interval
+        self.max_sends = max_sends
+        self.send_window = send_window
+
+    def _new_code(self) -> str:
+        return str(1000 + secrets.randbelow(9000))
+
+    def _wait(self, count: int, since_last: float, since_oldest: float) -> float:
+        """Seconds until a key with count sends in the window may send again"""
+        wait = 0.0
+        if count:
+            wait = self.resend_interval - since_last
+        if count >= self.max_sends:
+            wait = max(wait, self.send_window - since_oldest)
+        return wait
+
+    def _check(self, telegram_id: int, issued_phone: str, code_hash: str, attempts: int,
+               expired: bool, phone: str, code: str) -> VerifyResult:
+        """Judge a guess against an issued code; attempts includes this guess"""
+        if expired:
+            return VerifyResult(OtpCheck.EXPIRED, 0)
+        if attempts > self.max_attempts:
+            return VerifyResult(OtpCheck.TOO_MANY_ATTEMPTS, 0)
+        if phone == issued_phone and hmac.compare_digest(code_hash, _hash(telegram_id, code)):
+            return VerifyResult(OtpCheck.OK, self.max_attempts - attempts)
+        if attempts == self.max_attempts:
+            return VerifyResult(OtpCheck.TOO_MANY_ATTEMPTS, 0)
+        return VerifyResult(OtpCheck.WRONG, self.max_attempts - attempts)
+
+
+class _Entry(NamedTuple):
+    phone: str
+    code_hash: str
+    attempts: int
+    expires_at: float
+
+
+class InMemoryOtpStore(OtpPolicy):
+    """OTP store for a single process.
+
+    Codes and send histories expire through one min-heap of deadlines, so
+    abandoned registrations are dropped as soon as they time out; the store
+    never holds more than max_entries codes.
+    """
+
+    def __init__(self, max_entries: int = 100000, **policy):
+        super().__init__(**policy)
+        self.max_entries = max_entries
+        self._codes: dict[int, _Entry] = {}
+        self._sends: dict[str, deque[float]] = {}
+        self._deadlines: list[tuple[float, str, object]] = []  # (when, "code" or "send", key)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def _purge(self, now: float):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, kind, key = heapq.heappop(self._deadlines)
+            if kind == "code":
+                entry = self._codes.get(key)
+                # A reissued code has a later deadline of its own in the heap
+                if entry is not None and entry.expires_at <= now:
+                    del self._codes[key]
+            else:
+                sends = self._sends.get(key)
+                while sends and sends[0] <= now - self.send_window:
+                    sends.popleft()
+                if sends is not None and not sends:
+                    del self._sends[key]
+
+    async def issue(self, telegram_id: int, phone: str) -> IssueResult:
+        now = time.monotonic()
+        self._purge(now)
+        keys = (f"phone:{phone}", f"user:{telegram_id}")
+        wait = 0.0
+        for key in keys:
+            sends = self._sends.get(key)
+            if sends:
+                wait = max(wait, self._wait(len(sends), now - sends[-1], now - sends[0]))
+        if wait > 0:
+            return IssueResult(None, int(wait) + 1)
+
+        for key in keys:
+            self._sends.setdefault(key, deque()).append(now)
+            heapq.heappush(self._deadlines, (now + self.send_window, "send", key))
+        code = self._new_code()
+        # Re-inserting moves the user to the end, so the oldest entry is evicted first
+        self._codes.pop(telegram_id, None)
+        self._codes[telegram_id] = _Entry(phone, _hash(telegram_id, code), 0, now + self.ttl)
+        heapq.heappush(self._deadlines, (now + self.ttl, "code", telegram_id))
+        while len(self._codes) > self.max_entries:
+            del self._codes[next(iter(self._codes))]
+        return IssueResult(code, 0)
+
+    async def verify(self, telegram_id: int, phone: str, code: str) -> VerifyResult:
+        now = time.monotonic()
+        self._purge(now)
+        entry = self._codes.get(telegram_id)
+        if entry is None:
+            return VerifyResult(OtpCheck.EXPIRED, 0)
+        entry = self._codes[telegram_id] = entry._replace(attempts=entry.attempts + 1)
+        result = self._check(telegram_id, entry.phone, entry.code_hash, entry.attempts,
+                             entry.expires_at <= now, phone, code)
+        if result.check != OtpCheck.WRONG:
+            del self._codes[telegram_id]
+        return result
+
+    async def discard(self, telegram_id: int):
+        self._codes.pop(telegram_id, None)
+
+    async def refund(self, telegram_id: int, phone: str):
+        """Undo the latest issue() for a code that never reached the user, so it does not count as a send"""
+        self._codes.pop(telegram_id, None)
+        for key in (f"phone:{phone}", f"user:{telegram_id}"):
+            sends = self._sends.get(key)
+            if sends:
+                sends.pop()
+
+
+class PostgresOtpStore(OtpPolicy):
+    """OTP store shared by every replica through the otp_codes and otp_sends tables.
+
+    Only a hash of each code is stored. Sends for the same phone or user
+    are serialized with transaction-level advisory locks so concurrent
+    requests cannot slip past the throttle.
+    """
+
+    def __init__(self, purge_every: int = 100, **policy):
+        super().__init__(**policy)
+        self.purge_every = purge_every
+        self._issued = 0
+
+    async def issue(self, telegram_id: int, phone: str) -> IssueResult:
+        keys = sorted((f"phone:{phone}", f"user:{telegram_id}"))
+        async with AsyncSessionLocal() as session:
+            for key in keys:
+                await session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": key})
+            result = await session.execute(
+                select(
+                    OtpSend.key,
+                    func.count(),
+                    func.extract("epoch", func.now() - func.max(OtpSend.sent_at)),
+                    func.extract("epoch", func.now() - func.min(OtpSend.sent_at)),
+                )
+                .where(OtpSend.key.in_(keys), OtpSend.sent_at > func.now() - timedelta(seconds=self.send_window))
+                .group_by(OtpSend.key)
+            )
+            wait = max((self._wait(count, float(since_last), float(since_oldest))
+                        for _, count, since_last, since_oldest in result.all()), default=0.0)
+            if wait > 0:
+                return IssueResult(None, int(wait) + 1)
+
+            code = self._new_code()
+            await session.execute(insert(OtpSend).values([{"key": key, "sent_at": func.now()} for key in keys]))
+            values = {
+                "phone": phone,
+                "code_hash": _hash(telegram_id, code),
+                "attempts": 0,
+                "expires_at": func.now() + timedelta(seconds=self.ttl),
+                "created_at": func.now(),
+            }
+            stmt = insert(OtpCode).values(telegram_id=telegram_id, **values)
+            await session.execute(stmt.on_conflict_do_update(index_elements=[OtpCode.telegram_id], set_=values))
+            await session.commit()
+
+        self._issued += 1
+        if self._issued % self.purge_every == 0:
+            await self.purge()
+        return IssueResult(code, 0)
+
+    async def verify(self, telegram_id: int, phone: str, code: str) -> VerifyResult:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(OtpCode)
+                .where(OtpCode.telegram_id == telegram_id)
+                .values(attempts=OtpCode.attempts + 1)
+                .returning(OtpCode.phone, OtpCode.code_hash, OtpCode.attempts, OtpCode.expires_at <= func.now())
+            )
+            row = result.one_or_none()
+            if row is None:
+                return VerifyResult(OtpCheck.EXPIRED, 0)
+            verdict = self._check(telegram_id, row[0], row[1], row[2], row[3], phone, code)
+            if verdict.check != OtpCheck.WRONG:
+                await session.execute(delete(OtpCode).where(OtpCode.telegram_id == telegram_id))
+            await session.commit()
+            return verdict
+
+    async def discard(self, telegram_id: int):
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(OtpCode).where(OtpCode.telegram_id == telegram_id))
+            await session.commit()
+
+    async def refund(self, telegram_id: int, phone: str):
+        """Undo the latest issue() for a code that never reached the user, so it does not count as a send"""
+        keys = (f"phone:{phone}", f"user:{telegram_id}")
+        async with AsyncSessionLocal() as session:
+            latest = select(func.max(OtpSend.id)).where(OtpSend.key.in_(keys)).group_by(OtpSend.key)
+            await session.execute(delete(OtpSend).where(OtpSend.id.in_(latest)))
+            await session.execute(delete(OtpCode).where(OtpCode.telegram_id == telegram_id))
+            await session.commit()
+
+    async def purge(self):
+        """Delete expired codes and sends that no longer count towards any throttle"""
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(OtpCode).where(OtpCode.expires_at <= func.now()))
+            await session.execute(delete(OtpSend).where(OtpSend.sent_at <= func.now() - timedelta(seconds=self.send_window)))
+            await session.commit()
+
+
+def otp_store_from_env():
+    """Build the OTP store selected by OTP_STORE ("memory" or "postgres")"""
+    policy = dict(
+        ttl=int(os.getenv("OTP_TTL", "120")),
+        max_attempts=int(os.getenv("OTP_MAX_ATTEMPTS", "5")),
+        resend_interval=int(os.getenv("OTP_RESEND_INTERVAL", "60")),
+        max_sends=int(os.getenv("OTP_MAX_SENDS", "5")),
+        send_window=int(os.getenv("OTP_SEND_WINDOW", "3600")),
+    )
+    if os.getenv("OTP_STORE", "memory") == "postgres":
+        return PostgresOtpStore(**policy)
+    return InMemoryOtpStore(max_entries=int(os.getenv("OTP_MAX_ENTRIES", "100000")), **policy)
@@ -0,0 +1,291 @@
+import asyncio
+import copy
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+from cachetools import LRUCache
+from sqlalchemy import String, delete, literal, select, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert
+from telegram import Update
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+from db import AsyncSessionLocal
+from models import BotConversation, BotUserData
+
+logger = logging.getLogger(__name__)
+
+
+class PostgresPersistence(BasePersistence):
+    """Write-behind PTB persistence for conversations and user_data.
+
+    PTB hands us changed conversation states and user_data (after every
+    update, see after_update). Those calls only record the latest value per
+    key; one background flush writes the whole batch in a single
+    transaction.
+
+    Nothing is cached between updates: before each update, load_user_state
+    reads that user's conversation states and user_data in one query, so
+    replicas (and an old and a new container during a deploy) see each
+    other's writes. Only values this process has not finished writing are
+    kept from memory, since they are newer than the database.
+    """
+
+    def __init__(self, update_interval: float = 5, flush_delay: float = 0.2, loaded_users: int = 10000,
+                 retry_delay: float = 1, max_retry_delay: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.flush_delay = flush_delay
+        # A failed flush is retried after retry_delay, doubling up to max_retry_delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._failures = 0
+        self._pending_conversations: dict[tuple[str, str], Optional[object]] = {}
+        self._pending_user_data: dict[int, Optional[dict]] = {}
+        # Batch taken by the write in progress; like pending values, newer than the database
+        self._writing_conversations: dict[tuple[str, str], Optional[object]] = {}
+        self._writing_user_data: dict[int, Optional[dict]] = {}
+        # Resolved once the pending batch (next) or the batch being written (current) is committed or put back
+        self._next_written: Optional[asyncio.Future] = None
+        self._current_written: Optional[asyncio.Future] = None
+        # user_data read by load_user_state, handed to PTB in refresh_user_data for the same update
+        self._loaded_users: LRUCache = LRUCache(maxsize=loaded_users)
+        # Last user_data this process read from or wrote to the database. PTB marks
+        # a user for saving again when the update's task finishes, after this
+        # process may have lost the latest data to another replica; an unchanged
+        # copy is not written back over it
+        self._stored_user_data: LRUCache = LRUCache(maxsize=loaded_users)
+        self._flush_task: Optional[asyncio.Task] = None
+        # True while the delayed flush is still waiting, i.e. safe to cancel
+        self._flush_sleeping = False
+        self._write_lock = asyncio.Lock()
+
+    # -- loading --
+
+    async def get_user_data(self) -> dict:
+        # Loaded per user in refresh_user_data
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        # Loaded per user before each update in load_user_state
+        return {}
+
+    def _unwritten_conversation(self, name_key: tuple[str, str]) -> bool:
+        return name_key in self._pending_conversations or name_key in self._writing_conversations
+
+    def _unwritten_user_data(self, user_id: int) -> bool:
+        return user_id in self._pending_user_data or user_id in self._writing_user_data
+
+    async def load_user_state(self, application, update: object) -> None:
+        """Read the update's user's conversation states and user_data as stored by any replica.
+
+        Runs before the handlers see the update (PerUserUpdateProcessor's
+        before_update), since ConversationHandler looks up states synchronously.
+        """
+        if not isinstance(update, Update) or update.effective_user is None:
+            return
+        user_id = update.effective_user.id
+        # name -> TrackingDict of every persistent ConversationHandler (PTB 22 internals)
+        tracked = application._conversation_handler_conversations
+        # Every conversation handler here is per chat and per user
+        key = (update.effective_chat.id, user_id) if update.effective_chat else None
+        stored_key = json.dumps(list(key)) if key else None
+        names = [name for name in tracked if key and not self._unwritten_conversation((name, stored_key))]
+
+        statements = [select(literal(None, String).label("name"), BotUserData.data.label("state"))
+                      .where(BotUserData.user_id == user_id)]
+        if names:
+            statements.append(select(BotConversation.name, BotConversation.state)
+                              .where(BotConversation.name.in_(names), BotConversation.key == stored_key))
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(union_all(*statements))
+            rows = result.all()
+
+        stored = {name: state for name, state in rows if name is not None}
+        for name in names:
+            state = stored.get(name, ConversationHandler.END)
+            if state == ConversationHandler.END:
+                # Ended or never started, possibly by another replica; not a change to write back
+                tracked[name].data.pop(key, None)
+            else:
+                tracked[name].update_no_track({key: state})
+        data = next((state for name, state in rows if name is None), None) or {}
+        self._loaded_users[user_id] = data
+        self._stored_user_data[user_id] = copy.deepcopy(data)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if self._unwritten_user_data(user_id):
+            return
+        data = self._loaded_users.pop(user_id, None)
+        if data is None:
+            # Not loaded by load_user_state (an update without a user)
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(select(BotUserData.data).where(BotUserData.user_id == user_id))
+                data = result.scalar_one_or_none() or {}
+            self._stored_user_data[user_id] = copy.deepcopy(data)
+        # Replace rather than merge, so keys removed by another replica go away here too
+        user_data.clear()
+        user_data.update(data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # -- buffered writes --
+
+    async def update_conversation(self, name: str, key, new_state: Optional[object]) -> None:
+        self._pending_conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if not self._unwritten_user_data(user_id) and self._stored_user_data.get(user_id) == data:
+            return
+        self._pending_user_data[user_id] = dict(data)
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_user_data[user_id] = None
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        task, self._flush_task = self._flush_task, None
+        if task and not task.done():
+            if self._flush_sleeping:
+                task.cancel()
+            else:
+                # Already writing its batch; cancelling it now could lose that batch
+                await asyncio.wait([task])
+        await self._write()
+
+    async def wait_written(self) -> None:
+        """Wait until everything recorded so far has been written (or the attempt failed)"""
+        if self._pending_conversations or self._pending_user_data:
+            if self._next_written is None:
+                self._next_written = asyncio.get_running_loop().create_future()
+            written = self._next_written
+        elif self._current_written is not None:
+            written = self._current_written
+        else:
+            return
+        # Shielded: a cancelled waiter must not cancel the future other waiters share
+        await asyncio.shield(written)
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Let the rest of PTB's update_persistence batch arrive first
+        delay = self.flush_delay
+        while True:
+            self._flush_sleeping = True
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._flush_sleeping = False
+            written = await self._write()
+            # flush() took over, or nothing is left: changes made during the write, or a failed batch
+            if self._flush_task is not asyncio.current_task() or not (self._pending_conversations or self._pending_user_data):
+                return
+            delay = self.flush_delay if written else min(self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay)
+
+    async def _write(self) -> bool:
+        """Write everything pending in one transaction; False if it failed and the batch was put back"""
+        async with self._write_lock:
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            user_data, self._pending_user_data = self._pending_user_data, {}
+            written, self._next_written = self._next_written or asyncio.get_running_loop().create_future(), None
+            self._writing_conversations, self._writing_user_data = conversations, user_data
+            self._current_written = written
+            try:
+                if not conversations and not user_data:
+                    return True
+                return await self._write_batch(conversations, user_data)
+            finally:
+                self._writing_conversations, self._writing_user_data = {}, {}
+                self._current_written = None
+                if not written.done():
+                    written.set_result(None)
+
+    async def _write_batch(self, conversations: dict, user_data: dict) -> bool:
+        now = datetime.now()
+        try:
+            async with AsyncSessionLocal() as session:
+                upserts = [
+                    {"name": name, "key": key, "state": state, "updated_at": now}
+                    for (name, key), state in conversations.items() if state is not None
+                ]
+                removed = [name_key for name_key, state in conversations.items() if state is None]
+                if upserts:
+                    stmt = insert(BotConversation)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[BotConversation.name, BotConversation.key],
+                        set_={"state": stmt.excluded.state, "updated_at": stmt.excluded.updated_at},
+                    )
+                    await session.execute(stmt, upserts)
+                if removed:
+                    await session.execute(
+                        delete(BotConversation).where(tuple_(BotConversation.name, BotConversation.key).in_(removed))
+                    )
+
+                upserts = [
+                    {"user_id": user_id, "data": data, "updated_at": now}
+                    for user_id, data in user_data.items() if data is not None
+                ]
+                removed = [user_id for user_id, data in user_data.items() if data is None]
+                if upserts:
+                    stmt = insert(BotUserData)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[BotUserData.user_id],
+                        set_={"data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at},
+                    )
+                    await session.execute(stmt, upserts)
+                if removed:
+                    await session.execute(delete(BotUserData).where(BotUserData.user_id.in_(removed)))
+
+                await session.commit()
+        except asyncio.CancelledError:
+            self._requeue(conversations, user_data)
+            raise
+        except Exception as e:
+            self._failures += 1
+            logger.error(f"Persistence flush failed (attempt {self._failures}), retrying: {e}")
+            self._requeue(conversations, user_data)
+            return False
+        self._failures = 0
+        for user_id, data in user_data.items():
+            self._stored_user_data[user_id] = copy.deepcopy(data) if data is not None else {}
+        return True
+
+    def _requeue(self, conversations: dict, user_data: dict):
+        # Put the batch back unless a newer value arrived meanwhile
+        for key, state in conversations.items():
+            self._pending_conversations.setdefault(key, state)
+        for user_id, data in user_data.items():
+            self._pending_user_data.setdefault(user_id, data)
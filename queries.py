@@ -0,0 +1,91 @@
+from datetime import datetime
+
+from sqlalchemy import String, any_, bindparam, exists, select, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import selectinload
+
+from models import Order, OrderStatusEnum, Product, ReferralCode, Seller
+
+# Hot statements are built once with named bind parameters so every
+# execution reuses the same compiled SQL and the same server-side prepared
+# statement on each pooled connection (see db.warm_up).
+
+SELLER_BY_TELEGRAM_ID = (
+    select(Seller.id, Seller.telegram_id, Seller.name, Seller.number)
+    .where(Seller.telegram_id == bindparam("telegram_id"))
+)
+
+# has_prev says whether the seller has codes at or before the cursor, so a
+# page knows it is the first one even after earlier codes were deleted
+_codes_before_cursor = exists().where(
+    ReferralCode.owner_id == bindparam("owner_id"), ReferralCode.id <= bindparam("cursor")
+)
+
+CODES_AFTER = (
+    select(ReferralCode.id, ReferralCode.code, _codes_before_cursor.label("has_prev"))
+    .where(ReferralCode.owner_id == bindparam("owner_id"), ReferralCode.id > bindparam("cursor"))
+    .order_by(ReferralCode.id)
+    .limit(bindparam("limit"))
+)
+
+CODES_BEFORE = (
+    select(ReferralCode.id, ReferralCode.code)
+    .where(ReferralCode.owner_id == bindparam("owner_id"), ReferralCode.id < bindparam("cursor"))
+    .order_by(ReferralCode.id.desc())
+    .limit(bindparam("limit"))
+)
+
+CODE_DETAILS = (
+    select(ReferralCode.code, ReferralCode.product, ReferralCode.installment, ReferralCode.created_at)
+    .join(Seller, Seller.id == ReferralCode.owner_id)
+    .where(ReferralCode.id == bindparam("code_id"), Seller.telegram_id == bindparam("telegram_id"))
+)
+
+# Columns match referral_lookup.CodeRecord. ANY(array) keeps one statement
+# for any number of codes, unlike IN (...)
+CODES_BY_VALUE = (
+    select(ReferralCode.id, ReferralCode.code, ReferralCode.product, ReferralCode.installment,
+           ReferralCode.discount, ReferralCode.owner_id)
+    .where(ReferralCode.code == any_(bindparam("codes", type_=ARRAY(String))))
+)
+
+# A seller's orders with one status, newest first, keyset on (created_at, id)
+# so pages walk ix_orders_seller_id_status_created_at. Receipts come with a
+# single extra SELECT ... WHERE order_id IN (...) for the whole page
+_orders_page = (
+    select(Order, Product.name)
+    .join(Product, Product.id == Order.product_id)
+    .options(selectinload(Order.receipts))
+    .where(Order.seller_id == bindparam("seller_id"), Order.status == bindparam("status"))
+    .limit(bindparam("limit"))
+)
+_order_key = tuple_(Order.created_at, Order.id)
+_cursor = tuple_(bindparam("created_at"), bindparam("order_id"))
+
+ORDERS_OLDER = (
+    _orders_page.where(_order_key < _cursor)
+    .order_by(Order.created_at.desc(), Order.id.desc())
+)
+
+ORDERS_NEWER = (
+    _orders_page.where(_order_key > _cursor)
+    .order_by(Order.created_at, Order.id)
+)
+
+ORDER_WITH_RECEIPTS = (
+    select(Order)
+    .options(selectinload(Order.receipts))
+    .join(Seller, Seller.id == Order.seller_id)
+    .where(Order.id == bindparam("order_id"), Seller.telegram_id == bindparam("telegram_id"))
+)
+
+# Statement and harmless parameters for each query run by db.warm_up
+WARM_UP_QUERIES = [
+    (SELLER_BY_TELEGRAM_ID, {"telegram_id": -1}),
+    (CODES_AFTER, {"owner_id": -1, "cursor": 0, "limit": 1}),
+    (CODES_BEFORE, {"owner_id": -1, "cursor": 0, "limit": 1}),
+    (CODE_DETAILS, {"code_id": -1, "telegram_id": -1}),
+    (CODES_BY_VALUE, {"codes": []}),
+    (ORDERS_OLDER, {"seller_id": -1, "status": OrderStatusEnum.APPROVED, "limit": 1,
+                    "created_at": datetime.max, "order_id": 0}),
+]
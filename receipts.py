@@ -0,0 +1,111 @@
+import logging
+import os
+from contextlib import ExitStack
+
+from sqlalchemy import bindparam, update
+from telegram import Bot, InputFile, InputMediaDocument, InputMediaPhoto
+from telegram.error import BadRequest
+
+from db import AsyncSessionLocal
+from models import File
+
+logger = logging.getLogger(__name__)
+
+# Where the customer bot saves receipts; relative File.path values are resolved against it
+RECEIPTS_DIR = os.getenv("RECEIPTS_DIR", ".")
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+# Telegram accepts 2 to 10 items per media group
+MEDIA_GROUP_SIZE = 10
+
+# Against the table rather than the entity, so a list of parameters runs as one executemany
+SAVE_FILE_ID = (
+    update(File.__table__)
+    .where(File.__table__.c.id == bindparam("file_pk"))
+    .values(seller_bot_file_id=bindparam("new_file_id"))
+)
+
+
+def _is_photo(file: File) -> bool:
+    return file.path.lower().endswith(PHOTO_EXTENSIONS)
+
+
+def _file_path(file: File) -> str:
+    return os.path.join(RECEIPTS_DIR, file.path)
+
+
+def _sent_file_id(message) -> str | None:
+    if message.photo:
+        return message.photo[-1].file_id
+    if message.document:
+        return message.document.file_id
+    return None
+
+
+async def _send_group(bot: Bot, chat_id: int, files: list[File], upload_all: bool, caption: str | None):
+    """Send files as one message or media group, by this bot's file_id or uploaded from disk"""
+    with ExitStack() as stack:
+        media = []
+        for file in files:
+            if upload_all or not file.seller_bot_file_id:
+                # Streamed from the open file handle in chunks rather than read into memory
+                handle = stack.enter_context(open(_file_path(file), "rb"))
+                media.append(InputFile(handle, filename=os.path.basename(file.path),
+                                       attach=len(files) > 1, read_file_handle=False))
+            else:
+                media.append(file.seller_bot_file_id)
+
+        if len(files) == 1:
+            if _is_photo(files[0]):
+                return [await bot.send_photo(chat_id, media[0], caption=caption)]
+            return [await bot.send_document(chat_id, media[0], caption=caption)]
+        kind = InputMediaPhoto if _is_photo(files[0]) else InputMediaDocument
+        items = [kind(item, caption=caption if i == 0 else None) for i, item in enumerate(media)]
+        return list(await bot.send_media_group(chat_id, items))
+
+
+async def send_receipts(bot: Bot, chat_id: int, files: list[File], caption: str | None = None) -> int:
+    """Send an order's receipts, reusing Telegram file_ids where possible.
+
+    Files this bot has sent before go by the file_id it got back; the rest
+    are uploaded from disk. Photos and documents go in separate media
+    groups, since Telegram does not mix them. A group whose file_ids are
+    rejected as stale is uploaded again, and the ids Telegram returns are
+    saved on the File rows for next time. Returns how many receipts were sent.
+    """
+    # File.file_id is the customer bot's and would always be rejected here,
+    # so a file this bot has no id for can only be sent from disk
+    missing = [file for file in files if not file.seller_bot_file_id and not os.path.isfile(_file_path(file))]
+    if missing:
+        logger.warning(f"{len(missing)} receipt files missing under {RECEIPTS_DIR}")
+        files = [file for file in files if file not in missing]
+    photos = [file for file in files if _is_photo(file)]
+    documents = [file for file in files if not _is_photo(file)]
+    groups = [kind[i:i + MEDIA_GROUP_SIZE] for kind in (photos, documents) for i in range(0, len(kind), MEDIA_GROUP_SIZE)]
+
+    refreshed = []
+    sent = 0
+    for group in groups:
+        try:
+            messages = await _send_group(bot, chat_id, group, upload_all=False, caption=caption)
+        except BadRequest as e:
+            if all(not file.seller_bot_file_id for file in group):
+                raise
+            present = [file for file in group if os.path.isfile(_file_path(file))]
+            logger.info(f"Receipt file_ids rejected ({e.message}), uploading {len(present)} of {len(group)} files from disk")
+            if not present:
+                continue
+            group = present
+            messages = await _send_group(bot, chat_id, group, upload_all=True, caption=caption)
+        sent += len(group)
+        for file, message in zip(group, messages):
+            new_id = _sent_file_id(message)
+            if new_id and new_id != file.seller_bot_file_id:
+                refreshed.append({"file_pk": file.id, "new_file_id": new_id})
+        # Only the first message carries the caption
+        caption = None
+
+    if refreshed:
+        async with AsyncSessionLocal() as session:
+            await session.execute(SAVE_FILE_ID, refreshed)
+            await session.commit()
+    return sent
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+from typing import Iterable, NamedTuple, Optional
+
+import asyncpg
+from sqlalchemy import select, text
+
+from cache import code_page_cache
+from db import DB_URL, AsyncSessionLocal
+from models import ReferralCode, ReferralCodeProductEnum
+from queries import CODES_BY_VALUE
+
+logger = logging.getLogger(__name__)
+
+# Postgres NOTIFY channel carrying referral code inserts and deletes
+CHANNEL = "referral_codes"
+
+
+class CodeRecord(NamedTuple):
+    id: int
+    code: str
+    product: ReferralCodeProductEnum
+    installment: bool
+    discount: Optional[int]
+    owner_id: int
+
+
+RECORD_COLUMNS = (
+    ReferralCode.id,
+    ReferralCode.code,
+    ReferralCode.product,
+    ReferralCode.installment,
+    ReferralCode.discount,
+    ReferralCode.owner_id,
+)
+
+
+async def notify_upsert(session, record: CodeRecord):
+    """Announce a new code to every process; delivered when the session commits"""
+    payload = {"op": "upsert", **record._asdict(), "product": record.product.value}
+    await session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": json.dumps(payload)})
+
+
+async def notify_upsert_many(session, records: list[CodeRecord]):
+    """Announce a batch of new codes with one statement, one notification per code"""
+    if not records:
+        return
+    payloads = [json.dumps({"op": "upsert", **record._asdict(), "product": record.product.value}) for record in records]
+    await session.execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+        {"channel": CHANNEL, "payloads": payloads},
+    )
+
+
+async def notify_delete(session, code: str, owner_id: int):
+    """Announce a deleted code to every process; delivered when the session commits"""
+    payload = {"op": "delete", "code": code, "owner_id": owner_id}
+    await session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": json.dumps(payload)})
+
+
+class ReferralCodeIndex:
+    """In-memory index of every referral code, kept coherent with LISTEN/NOTIFY.
+
+    start() subscribes to the notification channel and then loads all codes.
+    Notifications that arrive while loading are replayed on top of the
+    snapshot. While the index is not ready (before warm-up, or after the
+    listener connection dropped) lookups fall back to the database, and
+    the index keeps reconnecting in the background until it is warm again.
+    """
+
+    def __init__(self, reconnect_delay: float = 5.0):
+        self.reconnect_delay = reconnect_delay
+        self.ready = False
+        self._by_code: dict[str, CodeRecord] = {}
+        self._conn: Optional[asyncpg.Connection] = None
+        self._backlog: Optional[list] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def __len__(self):
+        return len(self._by_code)
+
+    async def start(self):
+        """Subscribe and load every code; if that fails, keep retrying in the background"""
+        try:
+            await self._connect()
+        except Exception:
+            self._schedule_reconnect()
+            raise
+
+    async def stop(self):
+        self._closing = True
+        self.ready = False
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        await self._close_listener()
+
+    async def _connect(self):
+        # A listener left open by an attempt whose warm-up failed would leak
+        await self._close_listener()
+        await self._listen()
+        await self.warm()
+
+    async def _close_listener(self):
+        conn, self._conn = self._conn, None
+        if conn and not conn.is_closed():
+            # Closing on purpose is not a lost connection
+            conn.remove_termination_listener(self._on_terminated)
+            await conn.close()
+
+    async def warm(self):
+        """Rebuild the index from the database"""
+        self._backlog = []
+        by_code = {}
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.stream(select(*RECORD_COLUMNS).execution_options(yield_per=5000))
+                async for row in result:
+                    by_code[row.code] = CodeRecord(*row)
+        except Exception:
+            self._backlog = None
+            raise
+        self._by_code = by_code
+        backlog, self._backlog = self._backlog, None
+        for payload in backlog:
+            self._apply(payload)
+        self.ready = True
+        logger.info(f"Referral code index warmed with {len(by_code)} codes")
+
+    async def _listen(self):
+        self._conn = await asyncpg.connect(DB_URL.replace("postgresql+asyncpg://", "postgresql://"))
+        self._conn.add_termination_listener(self._on_terminated)
+        await self._conn.add_listener(CHANNEL, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Ignoring malformed {CHANNEL} notification: {payload!r}")
+            return
+        if self._backlog is not None:
+            self._backlog.append(payload)
+        else:
+            self._apply(payload)
+
+    def _on_terminated(self, connection):
+        if self._closing:
+            return
+        logger.warning("Referral code listener connection lost, falling back to the database")
+        self.ready = False
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._closing or (self._reconnect_task and not self._reconnect_task.done()):
+            return
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closing:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                await self._connect()
+                return
+            except Exception as e:
+                logger.error(f"Referral code index reconnect failed: {e}")
+
+    def _apply(self, payload: dict):
+        # Cached /list_codes pages of the owner are stale in every process, not just the one that made the change
+        if payload.get("owner_id") is not None:
+            code_page_cache.invalidate(payload["owner_id"])
+        if payload.get("op") == "delete":
+            self._by_code.pop(payload["code"], None)
+        elif payload.get("op") == "upsert":
+            self.add(CodeRecord(
+                id=payload["id"],
+                code=payload["code"],
+                product=ReferralCodeProductEnum(payload["product"]),
+                installment=payload["installment"],
+                discount=payload["discount"],
+                owner_id=payload["owner_id"],
+            ))
+
+    def add(self, record: CodeRecord):
+        self._by_code[record.code] = record
+
+    def discard(self, code: str):
+        self._by_code.pop(code, None)
+
+    async def resolve(self, code: str) -> Optional[CodeRecord]:
+        """Look up a single code"""
+        if self.ready:
+            return self._by_code.get(code)
+        return (await self.resolve_many([code])).get(code)
+
+    async def resolve_many(self, codes: Iterable[str]) -> dict[str, CodeRecord]:
+        """Look up several codes at once; unknown codes are left out of the result"""
+        codes = set(codes)
+        if self.ready:
+            return {code: self._by_code[code] for code in codes if code in self._by_code}
+        if not codes:
+            return {}
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(CODES_BY_VALUE, {"codes": list(codes)})
+            return {row.code: CodeRecord(*row) for row in result.all()}
+
+
+referral_index = ReferralCodeIndex()
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import signal
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+# Before db and the settings below read the environment (`python scheduler.py` does not go through sellersbot)
+load_dotenv()
+
+from aiolimiter import AsyncLimiter
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import Integer, any_, bindparam, func, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from db import AsyncSessionLocal, engine
+from models import JobRun, Order, OrderStatusEnum, Product, Seller
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = os.getenv("SCHEDULER_TIMEZONE", "Asia/Tehran")
+# Remind sellers this many days before an installment is due (0 is the day itself)
+REMINDER_DAYS = [int(day) for day in os.getenv("REMINDER_DAYS", "3,0").split(",")]
+REMINDER_TIME = os.getenv("REMINDER_TIME", "09:00")
+PURGE_INTERVAL_MINUTES = int(os.getenv("PURGE_INTERVAL_MINUTES", "10"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "20"))
+
+INSTALLMENTS = [
+    (Order.first_installment, "قسط اول"),
+    (Order.second_installment, "قسط دوم"),
+    (Order.third_installment, "قسط سوم"),
+]
+# Telegram's limit is 4096 characters; leave room for the header and the "more" line
+MESSAGE_LIMIT = 3800
+
+
+class DueInstallment(NamedTuple):
+    order_id: int
+    product: str
+    label: str
+    due: datetime
+
+
+@asynccontextmanager
+async def job_lock(name: str):
+    """Yield whether this process got the job's advisory lock; held until the block exits"""
+    async with engine.connect() as connection:
+        locked = await connection.scalar(text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": name})
+        try:
+            yield locked
+        finally:
+            if locked:
+                await connection.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": name})
+            await connection.commit()
+
+
+async def _claim_run(job: str, run_key: str) -> bool:
+    """Record the start of a daily run; False if that run already finished"""
+    async with AsyncSessionLocal() as session:
+        stmt = insert(JobRun).values(job=job, run_key=run_key, started_at=func.now())
+        # A run that started but never finished (the process died) is run again
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[JobRun.job, JobRun.run_key],
+            set_={"started_at": func.now()},
+            where=JobRun.finished_at.is_(None),
+        ).returning(JobRun.job)
+        result = await session.execute(stmt)
+        claimed = result.scalar_one_or_none() is not None
+        await session.commit()
+    return claimed
+
+
+async def _finish_run(job: str, run_key: str):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(JobRun).where(JobRun.job == job, JobRun.run_key == run_key).values(finished_at=func.now())
+        )
+        await session.commit()
+
+
+async def due_installments(start: datetime, end: datetime, batch_size: int = REMINDER_BATCH_SIZE):
+    """Yield (seller id, DueInstallment) for approved orders with an installment due in [start, end).
+
+    Each due date column is walked through its partial index in keyset
+    batches on (due date, order id).
+    """
+    for column, label in INSTALLMENTS:
+        cursor = (start, 0)
+        while True:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(Order.id, column, Product.name, Order.seller_id)
+                    .join(Product, Product.id == Order.product_id)
+                    .where(column.isnot(None), column >= start, column < end, Order.seller_id.isnot(None),
+                           tuple_(column, Order.id) > tuple_(*cursor),
+                           Order.status == OrderStatusEnum.APPROVED)
+                    .order_by(column, Order.id)
+                    .limit(batch_size)
+                )
+                rows = result.all()
+            for order_id, due, product, seller_id in rows:
+                yield seller_id, DueInstallment(order_id, product, label, due)
+            if len(rows) < batch_size:
+                break
+            cursor = (rows[-1][1], rows[-1][0])
+
+
+async def _telegram_ids(seller_ids: list[int]) -> list[tuple[int, int]]:
+    if not seller_ids:
+        return []
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(Seller.id, Seller.telegram_id).where(Seller.id == any_(bindparam("ids", type_=ARRAY(Integer)))),
+            {"ids": seller_ids},
+        )
+        return [tuple(row) for row in result.all()]
+
+
+def reminder_text(days_ahead: dict[int, list[DueInstallment]]) -> str:
+    lines = ["⏰ یادآوری اقساط مشتریان شما"]
+    length = len(lines[0])
+    total = sum(len(dues) for dues in days_ahead.values())
+    shown = 0
+    for days in sorted(days_ahead):
+        heading = "سررسید امروز:" if days == 0 else f"سررسید {days} روز دیگر:"
+        lines += ["", heading]
+        length += len(heading)
+        for due in sorted(days_ahead[days], key=lambda due: (due.due, due.order_id)):
+            line = f"#{due.order_id} - {due.product} - {due.label} - {due.due:%Y-%m-%d}"
+            if length + len(line) > MESSAGE_LIMIT:
+                lines += ["", f"... و {total - shown} مورد دیگر. برای جزئیات از /orders استفاده کنید"]
+                return "\n".join(lines)
+            lines.append(line)
+            length += len(line) + 1
+            shown += 1
+    return "\n".join(lines)
+
+
+class JobScheduler:
+    """Installment reminders and database housekeeping on an APScheduler AsyncIOScheduler.
+
+    Runs inside the bot (SCHEDULER=bot, the default) or as its own worker
+    with `python scheduler.py`. Every job takes a Postgres advisory lock
+    first, so any number of replicas can run the scheduler and each job
+    still runs once. Daily jobs also record their run in job_runs and skip
+    a day that is already done, which makes restarts and catch-up safe.
+    """
+
+    def __init__(self, timezone: str = TIMEZONE):
+        self.scheduler = AsyncIOScheduler(timezone=timezone)
+        self.limiter = AsyncLimiter(REMINDER_RATE, 1)
+        self.bot = None
+        self.otp_store = None
+
+    def start(self, bot, otp_store=None):
+        """Schedule the jobs; otp_store is the bot's own store when running inside the bot"""
+        from otp_store import otp_store_from_env
+
+        self.bot = bot
+        self.otp_store = otp_store or otp_store_from_env()
+        hour, minute = (int(part) for part in REMINDER_TIME.split(":"))
+        self._add_daily(self.installment_reminders, hour, minute, catch_up=True)
+        self.scheduler.add_job(self.purge, "interval", minutes=PURGE_INTERVAL_MINUTES, id="purge",
+                               coalesce=True, max_instances=1)
+        self.scheduler.start()
+        logger.info(f"Scheduler started with {len(self.scheduler.get_jobs())} jobs")
+
+    def stop(self):
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+
+    def _add_daily(self, job, hour: int, minute: int, catch_up: bool):
+        trigger = CronTrigger(hour=hour, minute=minute, timezone=self.scheduler.timezone)
+        now = datetime.now(self.scheduler.timezone)
+        next_run = trigger.get_next_fire_time(None, now)
+        if catch_up and now.replace(hour=hour, minute=minute, second=0, microsecond=0) <= now:
+            # Today's run was due before this process started; a no-op if another process did it
+            next_run = now
+        self.scheduler.add_job(job, trigger, id=job.__name__, coalesce=True, max_instances=1,
+                               misfire_grace_time=3600, next_run_time=next_run)
+
+    @asynccontextmanager
+    async def _daily_run(self, job: str):
+        """Yield True if this process should do today's run of a daily job"""
+        # Same clock as the naive order dates, so a run's key matches the day it scans
+        run_key = f"{datetime.now():%Y-%m-%d}"
+        async with job_lock(job) as locked:
+            if not locked or not await _claim_run(job, run_key):
+                yield False
+                return
+            yield True
+            await _finish_run(job, run_key)
+
+    async def installment_reminders(self):
+        """Send each seller one message listing their customers' upcoming installments"""
+        async with self._daily_run("installment_reminders") as run:
+            if not run:
+                return
+            # Order dates are stored as naive local times
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            by_seller: dict[int, dict[int, list[DueInstallment]]] = {}
+            for days in REMINDER_DAYS:
+                start = today + timedelta(days=days)
+                async for seller_id, due in due_installments(start, start + timedelta(days=1)):
+                    by_seller.setdefault(seller_id, {}).setdefault(days, []).append(due)
+            sent = 0
+            for seller_id, telegram_id in await _telegram_ids(list(by_seller)):
+                sent += await self._send(telegram_id, reminder_text(by_seller[seller_id]))
+            logger.info(f"Installment reminders sent to {sent} of {len(by_seller)} sellers")
+
+    async def purge(self):
+        """Delete expired OTP codes and code reservations"""
+        from code_reservations import code_reservations
+        from otp_store import PostgresOtpStore
+
+        async with job_lock("purge") as locked:
+            if not locked:
+                return
+            await code_reservations.purge()
+            if isinstance(self.otp_store, PostgresOtpStore):
+                await self.otp_store.purge()
+
+    async def _send(self, chat_id: int, message: str) -> bool:
+        for attempt in range(1, 4):
+            async with self.limiter:
+                try:
+                    await self.bot.send_message(chat_id, message)
+                    return True
+                except RetryAfter as e:
+                    delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                    await asyncio.sleep(delay)
+                except (Forbidden, BadRequest) as e:
+                    logger.warning(f"Reminder to {chat_id} rejected: {e}")
+                    return False
+                except NetworkError as e:
+                    logger.warning(f"Reminder to {chat_id} failed (attempt {attempt}): {e}")
+                    await asyncio.sleep(2 ** (attempt - 1))
+        return False
+
+
+job_scheduler = JobScheduler()
+
+
+async def _main():
+    """Run the scheduler on its own until SIGTERM or SIGINT"""
+    from telegram import Bot
+
+    # TELEGRAM_API_BASE_URL can point at a local Bot API (bench/fake_bot_api.py)
+    base_url = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+    bot = Bot(str(os.getenv("BOT_TOKEN")), base_url=base_url)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    async with bot:
+        job_scheduler.start(bot)
+        try:
+            await stopped.wait()
+        finally:
+            job_scheduler.stop()
+            await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
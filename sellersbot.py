@@ -1,22 +1,54 @@
-from telegram import KeyboardButton, ReplyKeyboardMarkup, Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+STARTED_AT = time.perf_counter()
+
+from dotenv import load_dotenv
+# Before the imports below, which read their configuration from the environment
+load_dotenv()
+
+from telegram import InputFile, KeyboardButton, ReplyKeyboardMarkup, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
 import os
-from dotenv import load_dotenv
-from db import AsyncSessionLocal
-from sqlalchemy import select
-from models import ReferralCode, ReferralCodeProductEnum, Seller
+from db import AsyncSessionLocal, engine, warm_up
+from sqlalchemy import delete, exists, select, text, true
+from sqlalchemy.dialects.postgresql import insert
+from models import Order, OrderStatusEnum, ReferralCode, ReferralCodeProductEnum, Seller
 from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import IntegrityError
-from kavenegar import KavenegarAPI
+from sms import SmsDispatcher, provider_from_env
+from cache import CodePage, code_page_cache, seller_cache
+from updates import PerUserUpdateProcessor
+from persistence import PostgresPersistence
+from referral_lookup import RECORD_COLUMNS, CodeRecord, notify_delete, notify_upsert, referral_index
+from code_reservations import code_reservations
+from bulk_codes import create_codes, generate_codes, parse_csv, report_csv
+from stats import seller_stats
+from metrics import MetricsServer, instrument_application, registry
+from broadcast import Broadcaster
+from otp_store import OtpCheck, otp_store_from_env
+from queries import CODE_DETAILS, CODES_AFTER, CODES_BEFORE, ORDER_WITH_RECEIPTS, ORDERS_NEWER, ORDERS_OLDER, WARM_UP_QUERIES
+from telegram.error import BadRequest
+from lifecycle import Lifecycle
+import asyncio
 import re
-import random
+import signal
 from datetime import datetime
+from functools import partial
+from typing import NamedTuple
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+lifecycle = Lifecycle(STARTED_AT)
+
+sms_dispatcher = SmsDispatcher(provider_from_env(), workers=int(os.getenv("SMS_WORKERS", "4")))
+otp_store = otp_store_from_env()
+
+registry.gauge("bot_sms_queue_depth", "SMS messages waiting to be sent", lambda: sms_dispatcher.pending)
+registry.gauge("bot_seller_cache_hits", "Seller cache hits", lambda: seller_cache.hits)
+registry.gauge("bot_seller_cache_misses", "Seller cache misses", lambda: seller_cache.misses)
+registry.gauge("bot_referral_index_size", "Codes in the referral code index", lambda: len(referral_index))
+registry.gauge("bot_startup_seconds", "Seconds from process start until ready", lambda: lifecycle.startup_seconds or 0)
 
 PRODUCT_MAP = {
     "محصولات الماس": ReferralCodeProductEnum.ALMAS,
@@ -31,6 +63,16 @@ PRODUCT_MAP = {
 
 (ASK_CODE, ASK_PRODUCT, ASK_INSTALLMENT) = range(3)
 
+CODES_PAGE_SIZE = int(os.getenv("CODES_PAGE_SIZE", "10"))
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "5"))
+BULK_CODES_MAX = int(os.getenv("BULK_CODES_MAX", "1000"))
+# Exports hold a database cursor open while they run, so only a few at a time
+export_semaphore = asyncio.Semaphore(int(os.getenv("EXPORT_CONCURRENCY", "2")))
+# bot runs the scheduled jobs in this process; off leaves them to `python scheduler.py`
+SCHEDULER_MODE = os.getenv("SCHEDULER", "bot")
+# Telegram ids allowed to use the admin commands, comma separated
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()}
+
 def is_valid_persian_name(name: str) -> bool:
     """Check if the name is a valid Persian name (2-5 words, 5-50 characters)"""
     return bool(re.fullmatch(r"[آ-ی\s]{5,50}", name.strip()))
@@ -44,14 +86,10 @@ async def register_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.effective_user:
         return ConversationHandler.END
     
-    async with AsyncSessionLocal() as session:
-        telegram_id = update.effective_user.id
-        result = await session.execute(select(Seller).where(Seller.telegram_id == telegram_id))
-        seller = result.scalar_one_or_none()
-        
-        if seller:
-            await update.message.reply_text("شما قبلاً ثبت‌نام کردید ✅")
-            return ConversationHandler.END
+    seller = await seller_cache.get(update.effective_user.id)
+    if seller:
+        await update.message.reply_text("شما قبلاً ثبت‌نام کردید ✅")
+        return ConversationHandler.END
     
     await update.message.reply_text("👤 لطفاً نام و نام خانوادگی خود را به فارسی وارد کنید:\nانصراف : /cancel")
     return ASK_NAME
@@ -94,24 +132,29 @@ async def handle_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data = {}
     context.user_data["phone"] = phone
 
-    # Generate OTP
-    otp = str(random.randint(1000, 9999))
-    context.user_data["otp"] = otp
+    # Issue an OTP unless this phone or user asked for one too recently
+    issued = await otp_store.issue(update.effective_user.id, phone)
+    if issued.code is None:
+        await update.message.reply_text(f"⏳ برای دریافت کد جدید لطفاً {issued.retry_after} ثانیه دیگر دوباره شماره را ارسال کنید.")
+        return ASK_PHONE
+    otp = issued.code
 
-    # Send OTP via Kavenegar
-    try:
-        api = KavenegarAPI(os.getenv("KAVENEGAR_API_KEY"))
-        api.verify_lookup({
-            "receptor": phone,
-            "token": otp,
-            "template": "verify",
-            "type": "sms"
-        })
-        await update.message.reply_text("✅ کد تایید پیامک شد. لطفاً کد را وارد کنید:")
-        return ASK_OTP
-    except Exception as e:
-        await update.message.reply_text(f"خطا در ارسال پیامک: {e}")
-        return ConversationHandler.END
+    # Queue the OTP SMS; delivery happens in the background
+    chat_id = update.effective_chat.id
+    telegram_id = update.effective_user.id
+
+    async def on_sms_result(delivered: bool, error: str | None):
+        if not delivered:
+            # The code never arrived, so it must not hold back the next attempt
+            await otp_store.refund(telegram_id, phone)
+            await context.bot.send_message(chat_id, f"خطا در ارسال پیامک: {error}\nلطفاً با /cancel لغو کرده و دوباره /register را بزنید.")
+
+    if not sms_dispatcher.submit(phone, otp, on_result=on_sms_result):
+        await otp_store.refund(telegram_id, phone)
+        await update.message.reply_text("❌ سرویس پیامک در حال حاضر شلوغ است. لطفاً چند لحظه بعد دوباره شماره را ارسال کنید.")
+        return ASK_PHONE
+    await update.message.reply_text("✅ کد تایید پیامک شد. لطفاً کد را وارد کنید:")
+    return ASK_OTP
 
 async def handle_otp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle OTP verification and complete registration"""
@@ -126,14 +169,22 @@ async def handle_otp(update: Update, context: ContextTypes.DEFAULT_TYPE):
     trans_table = str.maketrans(persian_digits, english_digits)
     code = code.translate(trans_table)
     
-    if context.user_data is None or code != context.user_data.get("otp"):
-        await update.message.reply_text("❌ کد وارد شده صحیح نیست. لطفا دوباره تلاش کنید:")
+    if context.user_data is None:
+        context.user_data = {}
+    verdict = await otp_store.verify(update.effective_user.id, context.user_data.get("phone"), code)
+    if verdict.check == OtpCheck.WRONG:
+        await update.message.reply_text(f"❌ کد وارد شده صحیح نیست. لطفا دوباره تلاش کنید ({verdict.attempts_left} تلاش باقی مانده):")
         return ASK_OTP
+    if verdict.check == OtpCheck.EXPIRED:
+        await update.message.reply_text("⌛ کد تایید منقضی شده است. لطفاً شماره موبایل خود را دوباره وارد کنید:")
+        return ASK_PHONE
+    if verdict.check == OtpCheck.TOO_MANY_ATTEMPTS:
+        await update.message.reply_text("⛔ تعداد تلاش ها بیش از حد مجاز است. لطفاً شماره موبایل خود را دوباره وارد کنید تا کد جدید ارسال شود:")
+        return ASK_PHONE
 
     name = context.user_data["name"]
     phone = context.user_data["phone"]
     telegram_id = update.effective_user.id
-    username = update.effective_user.username or ""
     
     async with AsyncSessionLocal() as session:
         # Check if seller already exists
@@ -144,19 +195,18 @@ async def handle_otp(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Update existing seller
             seller.name = name
             seller.number = phone
-            seller.username = username
             seller.updated_at = datetime.now()
         else:
             # Create new seller
             seller = Seller(
                 telegram_id=telegram_id,
-                username=username,
                 number=phone,
                 name=name
             )
             session.add(seller)
 
         await session.commit()
+    seller_cache.invalidate(telegram_id)
 
     await update.message.reply_text("🎉 ثبت‌نام شما با موفقیت انجام شد!")
     await start(update, context)
@@ -164,66 +214,204 @@ async def handle_otp(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the registration process"""
+    if update.effective_user:
+        await otp_store.discard(update.effective_user.id)
+        await code_reservations.release(update.effective_user.id)
     if update.message:
         await update.message.reply_text("فرآیند لغو شد.")
         await start(update, context)
     return ConversationHandler.END
 
-async def code_details(code_id: int):
+async def code_details(code_id: int, telegram_id: int):
+    """Fetch a code's details, only if it belongs to the given seller"""
     async with AsyncSessionLocal() as session:
-        code = await session.get(ReferralCode, code_id)
-        return code
+        result = await session.execute(CODE_DETAILS, {"code_id": code_id, "telegram_id": telegram_id})
+        return result.one_or_none()
+
+async def delete_code(code_id: int, telegram_id: int, anchor: int):
+    """Delete a seller's code and fetch the page it was on, in one statement.
+
+    Returns (owner_id, page), or None if the code does not exist or is not
+    owned by the seller.
+    """
+    owner_id = select(Seller.id).where(Seller.telegram_id == telegram_id).scalar_subquery()
+    deleted = (
+        delete(ReferralCode)
+        .where(ReferralCode.id == code_id, ReferralCode.owner_id == owner_id)
+        .returning(ReferralCode.id, ReferralCode.owner_id, ReferralCode.code)
+        .cte("deleted")
+    )
+    # The page query still sees the deleted row (same snapshot), so exclude it explicitly
+    page = (
+        select(ReferralCode.id, ReferralCode.code)
+        .where(ReferralCode.owner_id == deleted.c.owner_id, ReferralCode.id > anchor, ReferralCode.id != deleted.c.id)
+        .order_by(ReferralCode.id)
+        .limit(CODES_PAGE_SIZE + 1)
+        .lateral("page")
+    )
+    has_prev = exists().where(ReferralCode.owner_id == deleted.c.owner_id, ReferralCode.id <= anchor, ReferralCode.id != deleted.c.id)
+    stmt = (
+        select(deleted.c.owner_id, deleted.c.code, page.c.id, page.c.code, has_prev.label("has_prev"))
+        .select_from(deleted.outerjoin(page, true()))
+        .order_by(page.c.id)
+    )
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt)
+        rows = result.all()
+        if rows:
+            await notify_delete(session, rows[0][1], rows[0][0])
+        await session.commit()
+
+    if not rows:
+        return None
+    owner = rows[0][0]
+    referral_index.discard(rows[0][1])
+    codes = [(row[2], row[3]) for row in rows if row[2] is not None]
+    return owner, CodePage(codes[:CODES_PAGE_SIZE], has_prev=rows[0][4], has_next=len(codes) > CODES_PAGE_SIZE)
 
 async def inline_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     if query.data.startswith("code_"):
-        code_id = int(query.data.split("_")[1])
-        code = await code_details(code_id)
+        # Buttons sent before pagination carry no page anchor
+        _, code_id, *anchor = query.data.split("_")
+        anchor = anchor[0] if anchor else 0
+        code = await code_details(int(code_id), query.from_user.id)
+        if not code:
+            await query.answer("این کد پیدا نشد")
+            return
         await query.answer()
-        keyboard = [[InlineKeyboardButton("حذف", callback_data=f"delete_code_{code_id}"), InlineKeyboardButton("بازگشت", callback_data=f"list_codes")]]
+        keyboard = [[InlineKeyboardButton("حذف", callback_data=f"delete_code_{code_id}_{anchor}"), InlineKeyboardButton("بازگشت", callback_data=f"codes_next_{anchor}")]]
         await query.edit_message_text(f"کد {code.code} \n\n محصول {code.product} \n\n قابلیت قسطی {'بله' if code.installment else 'خیر'} \n\n تاریخ ایجاد: {code.created_at} \n\n", reply_markup=InlineKeyboardMarkup(keyboard))
     elif query.data.startswith("delete_code_"):
-        async with AsyncSessionLocal() as session:
-            user = await session.execute(select(Seller).where(Seller.telegram_id == query.from_user.id))
-            seller = user.scalar_one_or_none()
-            code_id = int(query.data.split("_")[2])
-            code = await session.get(ReferralCode, code_id)
-            if code.owner_id != seller.id:
-                await query.answer("شما اجازه حذف این کد را ندارید")
-                return
-            await session.delete(code)
-            await session.commit()
+        _, _, code_id, *anchor = query.data.split("_")
+        anchor = anchor[0] if anchor else 0
+        deleted = await delete_code(int(code_id), query.from_user.id, int(anchor))
+        if not deleted:
+            await query.answer("شما اجازه حذف این کد را ندارید")
+            return
+        owner_id, page = deleted
+        code_page_cache.invalidate(owner_id)
+        if page.rows:
+            code_page_cache.put(owner_id, ("after", int(anchor)), page)
+        else:
+            # That was the last code on its page; go back a page
+            page = await fetch_codes_page(owner_id, before_id=int(anchor) + 1)
+        await query.answer("کد با موفقیت حذف شد")
+        await query.edit_message_text(codes_page_text(page), reply_markup=codes_page_markup(page))
+    elif query.data.startswith("codes_") or query.data == "list_codes":
+        # codes_next_<last id of previous page> / codes_prev_<first id of next page>
+        _, direction, cursor = query.data.split("_") if query.data != "list_codes" else ("codes", "next", 0)
+        seller = await seller_cache.get(query.from_user.id)
+        if not seller:
+            await query.answer("شما هنوز ثبت نام نکرده اید")
+            return
+        if direction == "next":
+            page = await fetch_codes_page(seller.id, after_id=int(cursor))
+        else:
+            page = await fetch_codes_page(seller.id, before_id=int(cursor))
+        await query.answer()
+        await query.edit_message_text(codes_page_text(page), reply_markup=codes_page_markup(page))
+    elif query.data.startswith("orders_"):
+        # orders_<older|newer>_<status>[_<created_at>_<id>]
+        _, direction, status, *cursor = query.data.split("_")
+        seller = await seller_cache.get(query.from_user.id)
+        if not seller:
+            await query.answer("شما هنوز ثبت نام نکرده اید")
+            return
+        cursor = (datetime.strptime(cursor[0], ORDER_CURSOR_FORMAT), int(cursor[1])) if cursor else None
+        if direction == "newer":
+            page = await fetch_orders_page(seller.id, OrderStatusEnum[status], newer_than=cursor)
+        else:
+            page = await fetch_orders_page(seller.id, OrderStatusEnum[status], older_than=cursor)
         await query.answer()
-        await query.edit_message_text("کد با موفقیت حذف شد")
-        return await list_codes_func(update, context)
+        try:
+            await query.edit_message_text(orders_page_text(page), reply_markup=orders_page_markup(page))
+        except BadRequest as e:
+            # Tapping the tab that is already open changes nothing
+            if "not modified" not in e.message:
+                raise
+    elif query.data.startswith("receipts_"):
+        order = await order_with_receipts(int(query.data.split("_")[1]), query.from_user.id)
+        if not order:
+            await query.answer("این سفارش پیدا نشد")
+            return
+        if not order.receipts:
+            await query.answer("برای این سفارش رسیدی ثبت نشده است")
+            return
+        await query.answer("در حال ارسال رسید ها...")
+        from receipts import send_receipts
+
+        sent = await send_receipts(context.bot, query.message.chat_id, order.receipts, caption=f"🧾 رسید های سفارش #{order.id}")
+        if not sent:
+            await context.bot.send_message(query.message.chat_id, "❌ فایل رسید های این سفارش در دسترس نیست.")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("به ربات نمایندگان ماز خوش امدید برای استفاده از ربات میتونید از دستورات بخش Menu استفاده کنید یا از دستور /help برای دریافت راهنمایی استفاده کنید \n\n/help راهنمایی ")
 
 async def help_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("برای استفاده از ربات میتونید از دستورات زیر استفاده کنید \n\n/start شروع ربات \n /list_codes لیست کد ها و مدیریت کد ها\n /add_code اضافه کردن کد \n /register ثبت نام\n /help راهنمایی")
+    await update.message.reply_text("برای استفاده از ربات میتونید از دستورات زیر استفاده کنید \n\n/start شروع ربات \n /list_codes لیست کد ها و مدیریت کد ها\n /add_code اضافه کردن کد \n /bulk_codes ساخت گروهی کد (یا ارسال فایل CSV)\n /stats آمار فروش\n /orders سفارش ها و رسید ها\n /export خروجی سفارش ها و کد ها (CSV یا اکسل)\n /register ثبت نام\n /help راهنمایی")
 
-async def list_codes_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def fetch_codes_page(owner_id: int, after_id: int = 0, before_id: int | None = None) -> CodePage:
+    """Fetch one page of a seller's codes by keyset on (owner_id, id)"""
+    cursor = ("before", before_id) if before_id is not None else ("after", after_id)
+    page = code_page_cache.get(owner_id, cursor)
+    if page is not None:
+        return page
+
+    stmt = CODES_BEFORE if before_id is not None else CODES_AFTER
+    params = {"owner_id": owner_id, "cursor": before_id if before_id is not None else after_id, "limit": CODES_PAGE_SIZE + 1}
     async with AsyncSessionLocal() as session:
-        user = await session.execute(select(Seller).where(Seller.telegram_id == update.message.from_user.id))
-        seller = user.scalar_one_or_none()
-        if seller:
-            result = await session.execute(select(ReferralCode).where(ReferralCode.owner_id == seller.id))
-            codes = result.scalars().all()
-            keyboard = [[InlineKeyboardButton(code.code, callback_data=f"code_{code.id}")] for code in codes]
-            await update.message.reply_text("لیست کد های شما", reply_markup=InlineKeyboardMarkup(keyboard))
-        else:
-            await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
-            return start(update, context)
+        result = await session.execute(stmt, params)
+        rows = [tuple(row) for row in result.all()]
+
+    more = len(rows) > CODES_PAGE_SIZE
+    rows = rows[:CODES_PAGE_SIZE]
+    if before_id is not None:
+        if not rows:
+            # Everything before the cursor was deleted; show the first page instead
+            return await fetch_codes_page(owner_id)
+        page = CodePage(rows[::-1], has_prev=more, has_next=True)
+    elif not rows and after_id > 0:
+        # Everything after the cursor was deleted; show the page before it instead
+        return await fetch_codes_page(owner_id, before_id=after_id + 1)
+    else:
+        page = CodePage([row[:2] for row in rows], has_prev=bool(rows) and rows[0][2], has_next=more)
+    code_page_cache.put(owner_id, cursor, page)
+    return page
+
+def codes_page_text(page: CodePage) -> str:
+    return "لیست کد های شما" if page.rows else "شما هنوز کدی ثبت نکرده اید. برای اضافه کردن کد از دستور /add_code استفاده کنید"
+
+def codes_page_markup(page: CodePage) -> InlineKeyboardMarkup:
+    # Every button remembers where its page starts so "back" and delete return to the same page
+    anchor = page.rows[0][0] - 1 if page.rows else 0
+    keyboard = [[InlineKeyboardButton(code, callback_data=f"code_{code_id}_{anchor}")] for code_id, code in page.rows]
+    navigation = []
+    if page.has_prev and page.rows:
+        navigation.append(InlineKeyboardButton("« قبلی", callback_data=f"codes_prev_{page.rows[0][0]}"))
+    if page.has_next and page.rows:
+        navigation.append(InlineKeyboardButton("بعدی »", callback_data=f"codes_next_{page.rows[-1][0]}"))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(keyboard)
+
+async def list_codes_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    seller = await seller_cache.get(update.message.from_user.id)
+    if not seller:
+        await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
+        return await start(update, context)
+    page = await fetch_codes_page(seller.id)
+    await update.message.reply_text(codes_page_text(page), reply_markup=codes_page_markup(page))
 
 async def add_code_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
-    async with AsyncSessionLocal() as session:
-        seller = await session.execute(select(Seller).where(Seller.telegram_id == user.id))
-        seller = seller.scalar_one_or_none()
-        if not seller:
-            await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
-            return start(update, context)
+    seller = await seller_cache.get(user.id)
+    if not seller:
+        await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
+        await start(update, context)
+        return ConversationHandler.END
+    for key in ("code", "product", "installment"):
+        context.user_data.pop(key, None)
     await update.message.reply_text("لطفا کد را وارد کنید ، کد میتواند تلفیقی از حروف و اعداد و یا فقط حرف و عدد باشد(حداقل 5 کاراکتر انگلیسی). \n\n/cancel لغو")
     return ASK_CODE
 
@@ -235,17 +423,18 @@ async def handle_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not code.isalpha() and not code.isdigit():
         await update.message.reply_text("کد باید تلفیق و یا فقط حروف و اعداد انگلیسی باشد")
         return ASK_CODE
-    async with AsyncSessionLocal() as session:
-        code_check = await session.execute(select(ReferralCode).where(ReferralCode.code == code))
-        code_check = code_check.scalar_one_or_none()
-        if code_check:
-            await update.message.reply_text("کد تکراری است لطفا کد دیگری وارد کنید")
-            return ASK_CODE
-    
+    # Known codes are turned away from memory; the reservation is what settles races
+    if await referral_index.resolve(code) or not await code_reservations.reserve(code, update.message.from_user.id):
+        await update.message.reply_text("کد تکراری است لطفا کد دیگری وارد کنید")
+        return ASK_CODE
+    context.user_data["code"] = code
+    if "installment" in context.user_data:
+        # Back here because the first choice was lost at the last step; the rest is already answered
+        return await save_code(update, context)
+
     keyboard = [[KeyboardButton("محصولات الماس"), KeyboardButton("پایه 5ام")], [KeyboardButton("پایه 6ام"), KeyboardButton("پایه 7ام")], [KeyboardButton("پایه 8ام"), KeyboardButton("پایه 9ام")]]
     keyboard_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     await update.message.reply_text("لطفا محصول یا محصولاتی که میخواهید کد را به آن اختصاص دهید انتخاب کنید", reply_markup=keyboard_markup)
-    context.user_data["code"] = code
     return ASK_PRODUCT
 
 
@@ -271,44 +460,426 @@ async def handle_installment(update: Update, context: ContextTypes.DEFAULT_TYPE)
         context.user_data["installment"] = True
     else:
         context.user_data["installment"] = False
-    
+    return await save_code(update, context)
+
+async def save_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Insert the code from the add_code dialog, using up its reservation"""
     try:
+        seller = await seller_cache.get(update.message.from_user.id)
         async with AsyncSessionLocal() as session:
-            seller = await session.execute(select(Seller).where(Seller.telegram_id == update.message.from_user.id))
-            seller = seller.scalar_one_or_none()
             if not seller:
                 await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
-                return start(update, context)
-            enum_product = PRODUCT_MAP[context.user_data["product"]]
-            code = ReferralCode(
-                code=context.user_data["code"],
-                discount=0,  # Set default discount to 0
-                product=enum_product,
-                installment=context.user_data["installment"],
-                owner_id=seller.id
-            )
-            session.add(code)
+                await start(update, context)
+                return ConversationHandler.END
+            record = None
+            held = await code_reservations.consume(session, context.user_data["code"], update.message.from_user.id)
+            if not held and await code_reservations.reserve(context.user_data["code"], update.message.from_user.id):
+                # The hold had expired and been purged, but nobody else took the code
+                held = await code_reservations.consume(session, context.user_data["code"], update.message.from_user.id)
+            if held:
+                stmt = insert(ReferralCode).values(
+                    code=context.user_data["code"],
+                    discount=0,  # Set default discount to 0
+                    product=PRODUCT_MAP[context.user_data["product"]],
+                    installment=context.user_data["installment"],
+                    owner_id=seller.id
+                )
+                result = await session.execute(stmt.on_conflict_do_nothing(index_elements=[ReferralCode.code]).returning(*RECORD_COLUMNS))
+                row = result.one_or_none()
+                record = CodeRecord(*row) if row else None
+            if record is None:
+                # The reservation expired and someone else took the code; keep the other answers
+                await session.rollback()
+                await update.message.reply_text("❌ این کد در این فاصله توسط نماینده دیگری ثبت شد. لطفا کد دیگری وارد کنید، بقیه اطلاعات حفظ شده است.\n\n/cancel لغو")
+                return ASK_CODE
+            await notify_upsert(session, record)
             await session.commit()
-            await update.message.reply_text("کد با موفقیت اضافه شد لطفا برای اضافه کردن کد دیگری از دستور /add_code استفاده کنید")
-            return list_codes_func(update, context)
+        for key in ("code", "product", "installment"):
+            context.user_data.pop(key, None)
+        referral_index.add(record)
+        code_page_cache.invalidate(seller.id)
+        await update.message.reply_text("کد با موفقیت اضافه شد لطفا برای اضافه کردن کد دیگری از دستور /add_code استفاده کنید")
+        await list_codes_func(update, context)
+        return ConversationHandler.END
     except IntegrityError as e:
         logger.error(f"Database integrity error: {e}")
         await update.message.reply_text("❌ خطا در ایجاد کد. لطفاً مجدداً تلاش کنید یا با پشتیبانی تماس بگیرید.")
         return ConversationHandler.END
     except Exception as e:
-        logger.error(f"Unexpected error in handle_installment: {e}")
+        logger.error(f"Unexpected error in save_code: {e}")
         await update.message.reply_text("❌ خطای غیرمنتظره. لطفاً مجدداً تلاش کنید.")
         return ConversationHandler.END
 
-if __name__ == "__main__":
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
-    app = ApplicationBuilder().token(str(BOT_TOKEN)).build()
-    logger.info("Bot started")
-    
-    
+BULK_CODES_USAGE = (
+    "ساخت گروهی کد:\n/bulk_codes <تعداد> <پیشوند> <محصول> [قسطی]\n"
+    "محصول یکی از: " + "، ".join(product.value for product in ReferralCodeProductEnum) + "\n"
+    "مثال: /bulk_codes 100 SUMMER almas\n\n"
+    "یا یک فایل CSV با ستون های code,product,installment ارسال کنید."
+)
+
+async def send_bulk_report(update: Update, seller_id: int, results, created):
+    for record in created:
+        referral_index.add(record)
+    code_page_cache.invalidate(seller_id)
+    rejected = len(results) - len(created)
+    await update.message.reply_document(
+        InputFile(report_csv(results), filename="codes_report.csv"),
+        caption=f"✅ {len(created)} کد ساخته شد، ❌ {rejected} کد رد شد.",
+    )
+
+async def bulk_codes_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Generate a batch of codes: /bulk_codes <count> <prefix> <product> [قسطی]"""
+    seller = await seller_cache.get(update.message.from_user.id)
+    if not seller:
+        await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
+        return
+    args = context.args or []
+    try:
+        count = int(args[0])
+        prefix = args[1]
+        product = ReferralCodeProductEnum(args[2].lower())
+    except (IndexError, ValueError):
+        await update.message.reply_text(BULK_CODES_USAGE)
+        return
+    if not 1 <= count <= BULK_CODES_MAX or not re.fullmatch(r"[A-Za-z0-9]{1,20}", prefix):
+        await update.message.reply_text(f"تعداد باید بین 1 و {BULK_CODES_MAX} و پیشوند فقط حروف و اعداد انگلیسی باشد.")
+        return
+    installment = len(args) > 3 and args[3] == "قسطی"
+
+    results, created = await create_codes(seller.id, generate_codes(prefix.upper(), count, product, installment))
+    await send_bulk_report(update, seller.id, results, created)
+
+async def bulk_import_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Import codes from an uploaded CSV file"""
+    seller = await seller_cache.get(update.message.from_user.id)
+    if not seller:
+        await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
+        return
+    document = update.message.document
+    if document.file_size and document.file_size > 1024 * 1024:
+        await update.message.reply_text("حجم فایل نباید بیشتر از 1 مگابایت باشد.")
+        return
+    data = await (await document.get_file()).download_as_bytearray()
+    try:
+        rows = parse_csv(bytes(data), PRODUCT_MAP)
+    except UnicodeDecodeError:
+        await update.message.reply_text("فایل باید با کدگذاری UTF-8 ذخیره شده باشد.")
+        return
+    if not rows or len(rows) > BULK_CODES_MAX:
+        await update.message.reply_text(f"فایل باید بین 1 و {BULK_CODES_MAX} ردیف داشته باشد.\n\n" + BULK_CODES_USAGE)
+        return
+
+    results, created = await create_codes(seller.id, rows)
+    await send_bulk_report(update, seller.id, results, created)
+
+STATUS_LABELS = {
+    OrderStatusEnum.APPROVED: "تایید شده",
+    OrderStatusEnum.PENDING: "در انتظار",
+    OrderStatusEnum.REJECTED: "رد شده",
+}
+
+async def stats_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the seller's sales figures from the rollup tables"""
+    seller = await seller_cache.get(update.message.from_user.id)
+    if not seller:
+        await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
+        return
+    stats = await seller_stats(seller.id)
+    if not stats.totals:
+        await update.message.reply_text("هنوز سفارشی با کد های شما ثبت نشده است.")
+        return
+
+    lines = ["📊 آمار فروش شما", ""]
+    for status, label in STATUS_LABELS.items():
+        count, revenue, discount = stats.totals.get(status, (0, 0, 0))
+        lines.append(f"{label}: {count} سفارش - {revenue:,} تومان")
+    if stats.products:
+        lines += ["", "🏆 پرفروش ترین محصولات (تایید شده):"]
+        lines += [f"{name}: {count} سفارش - {revenue:,} تومان" for name, count, revenue in stats.products]
+    if stats.days:
+        lines += ["", "📅 هفت روز اخیر (تایید شده):"]
+        lines += [f"{day}: {count} سفارش - {revenue:,} تومان" for day, count, revenue in stats.days]
+    await update.message.reply_text("\n".join(lines))
+
+class OrdersPage(NamedTuple):
+    status: OrderStatusEnum
+    rows: list  # [(Order with receipts loaded, product name), ...] newest first
+    has_newer: bool
+    has_older: bool
+
+# created_at goes into callback data, which Telegram limits to 64 bytes
+ORDER_CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+
+async def fetch_orders_page(seller_id: int, status: OrderStatusEnum, older_than: tuple | None = None,
+                            newer_than: tuple | None = None) -> OrdersPage:
+    """Fetch one page of a seller's orders with a status, by keyset on (created_at, id)"""
+    cursor = newer_than or older_than or (datetime.max, 0)
+    stmt = ORDERS_NEWER if newer_than else ORDERS_OLDER
+    params = {"seller_id": seller_id, "status": status, "created_at": cursor[0], "order_id": cursor[1],
+              "limit": ORDERS_PAGE_SIZE + 1}
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(stmt, params)
+        rows = [tuple(row) for row in result.all()]
+
+    more = len(rows) > ORDERS_PAGE_SIZE
+    rows = rows[:ORDERS_PAGE_SIZE]
+    if newer_than:
+        if not rows:
+            return await fetch_orders_page(seller_id, status)
+        return OrdersPage(status, rows[::-1], has_newer=more, has_older=True)
+    return OrdersPage(status, rows, has_newer=older_than is not None, has_older=more)
+
+async def order_with_receipts(order_id: int, telegram_id: int) -> Order | None:
+    """Fetch an order and its receipts, only if it was sold by the given seller"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(ORDER_WITH_RECEIPTS, {"order_id": order_id, "telegram_id": telegram_id})
+        return result.scalar_one_or_none()
+
+def orders_page_text(page: OrdersPage) -> str:
+    if not page.rows:
+        return f"📦 سفارش {STATUS_LABELS[page.status]} ندارید."
+    lines = [f"📦 سفارش های {STATUS_LABELS[page.status]}"]
+    for order, product in page.rows:
+        lines += ["", f"#{order.id} - {product}", f"💰 {order.final_price:,} تومان" + (f" (تخفیف {order.discount:,})" if order.discount else "")]
+        if order.installment:
+            dates = [f"{date:%Y-%m-%d}" for date in (order.first_installment, order.second_installment, order.third_installment) if date]
+            lines.append("قسطی" + (f": {' / '.join(dates)}" if dates else ""))
+        lines.append(f"📅 {order.created_at:%Y-%m-%d %H:%M}")
+    return "\n".join(lines)
+
+def orders_page_markup(page: OrdersPage) -> InlineKeyboardMarkup:
+    keyboard = [[
+        InlineKeyboardButton(("• " if status == page.status else "") + label, callback_data=f"orders_older_{status.name}")
+        for status, label in STATUS_LABELS.items()
+    ]]
+    keyboard += [
+        [InlineKeyboardButton(f"🧾 رسید های سفارش #{order.id} ({len(order.receipts)})", callback_data=f"receipts_{order.id}")]
+        for order, _ in page.rows if order.receipts
+    ]
+    navigation = []
+    if page.has_newer and page.rows:
+        first = page.rows[0][0]
+        navigation.append(InlineKeyboardButton("« جدیدتر", callback_data=f"orders_newer_{page.status.name}_{first.created_at:{ORDER_CURSOR_FORMAT}}_{first.id}"))
+    if page.has_older and page.rows:
+        last = page.rows[-1][0]
+        navigation.append(InlineKeyboardButton("قدیمی تر »", callback_data=f"orders_older_{page.status.name}_{last.created_at:{ORDER_CURSOR_FORMAT}}_{last.id}"))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(keyboard)
+
+async def orders_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the seller's orders, one status per tab, with buttons for their receipts"""
+    seller = await seller_cache.get(update.message.from_user.id)
+    if not seller:
+        await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
+        return
+    page = await fetch_orders_page(seller.id, OrderStatusEnum.APPROVED)
+    await update.message.reply_text(orders_page_text(page), reply_markup=orders_page_markup(page))
+
+EXPORT_USAGE = (
+    "خروجی گرفتن:\n/export orders سفارش های ثبت شده با کد های شما\n/export codes کد های شما\n\n"
+    "برای فایل اکسل xlsx را اضافه کنید، مثال: /export orders xlsx"
+)
+
+async def export_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send the seller's orders or codes as a document: /export [orders|codes] [csv|xlsx]"""
+    seller = await seller_cache.get(update.message.from_user.id)
+    if not seller:
+        await update.message.reply_text("شما هنوز ثبت نام نکرده اید لطفا برای ثبت نام از دستور /register استفاده کنید")
+        return
+    # Rarely used, so imported on first use rather than at startup
+    from export import EXPORTS, FORMATS, ExportTooLarge, export_seller
+
+    args = [arg.lower() for arg in context.args or []]
+    kind = args[0] if args else "orders"
+    fmt = args[1] if len(args) > 1 else "csv"
+    if kind not in EXPORTS or fmt not in FORMATS:
+        await update.message.reply_text(EXPORT_USAGE)
+        return
+
+    async with export_semaphore:
+        try:
+            output, count = await export_seller(kind, seller.id, fmt)
+        except ExportTooLarge:
+            await update.message.reply_text("❌ فایل خروجی از حداکثر حجم مجاز تلگرام بزرگتر است.")
+            return
+    with output:
+        if count == 0:
+            await update.message.reply_text("موردی برای خروجی گرفتن وجود ندارد.")
+            return
+        # Let the HTTP client stream the file instead of reading it into memory first
+        filename = f"{kind}_{datetime.now():%Y%m%d}.{fmt}"
+        await update.message.reply_document(
+            InputFile(output, filename=filename, read_file_handle=False),
+            caption=f"📄 {count} ردیف",
+        )
+
+def is_admin(update: Update) -> bool:
+    return update.effective_user is not None and update.effective_user.id in ADMIN_IDS
+
+BROADCAST_STATUS_LABELS = {"running": "در حال ارسال", "done": "تمام شده", "cancelled": "لغو شده"}
+
+async def broadcast_finished(broadcast):
+    """Tell the admin who started a broadcast that it is done"""
+    if broadcast.created_by:
+        await broadcaster.bot.send_message(
+            broadcast.created_by,
+            f"✅ پیام همگانی {broadcast.id}{' (آزمایشی)' if broadcast.dry_run else ''} تمام شد\n"
+            f"ارسال شده: {broadcast.sent}\nناموفق: {broadcast.failed}\nربات را مسدود کرده اند: {broadcast.blocked}",
+        )
+
+broadcaster = Broadcaster(on_finished=broadcast_finished)
+
+async def broadcast_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send the text after the command to every seller; /broadcast_dry goes through the motions without sending"""
+    if not is_admin(update):
+        await update.message.reply_text("شما به این دستور دسترسی ندارید")
+        return
+    command, *text = update.message.text.split(maxsplit=1)
+    text = text[0] if text else ""
+    dry_run = command.startswith("/broadcast_dry")
+    if not text.strip():
+        await update.message.reply_text("متن پیام را بعد از دستور بنویسید، مثال:\n/broadcast محصول جدید اضافه شد")
+        return
+    broadcast_id = await broadcaster.create(text.strip(), update.effective_user.id, dry_run=dry_run)
+    broadcaster.launch(broadcast_id)
+    await update.message.reply_text(
+        f"📣 پیام همگانی {broadcast_id}{' (آزمایشی)' if dry_run else ''} شروع شد.\n"
+        f"وضعیت: /broadcasts\nلغو: /broadcast_cancel {broadcast_id}"
+    )
+
+async def broadcasts_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show progress of the latest broadcasts"""
+    if not is_admin(update):
+        await update.message.reply_text("شما به این دستور دسترسی ندارید")
+        return
+    broadcasts = await broadcaster.recent()
+    if not broadcasts:
+        await update.message.reply_text("هنوز پیام همگانی ارسال نشده است.")
+        return
+    lines = [
+        f"{broadcast.id}{' (آزمایشی)' if broadcast.dry_run else ''} - {BROADCAST_STATUS_LABELS.get(broadcast.status, broadcast.status)}: "
+        f"{broadcast.sent} ارسال، {broadcast.failed} ناموفق، {broadcast.blocked} مسدود"
+        for broadcast in broadcasts
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+async def broadcast_cancel_func(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop a running broadcast"""
+    if not is_admin(update):
+        await update.message.reply_text("شما به این دستور دسترسی ندارید")
+        return
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("شماره پیام همگانی را وارد کنید، مثال: /broadcast_cancel 3")
+        return
+    if await broadcaster.cancel(int(context.args[0])):
+        await update.message.reply_text("پیام همگانی لغو شد.")
+    else:
+        await update.message.reply_text("پیام همگانی در حال ارسالی با این شماره پیدا نشد.")
+
+async def database_ready() -> bool:
+    # Not ready until post_init has finished, and no longer once draining for shutdown
+    if not lifecycle.ready:
+        return False
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    return True
+
+metrics_server = MetricsServer(os.getenv("METRICS_HOST", "0.0.0.0"), int(os.getenv("METRICS_PORT", "9100")), database_ready)
+
+# Set by main(); PTB's own handlers would stop without marking the process not ready first
+STOP_SIGNALS_HANDLED = False
+
+def begin_drain(app):
+    """Stop signal handler: report not ready, then let PTB stop fetching and finish in-flight updates"""
+    lifecycle.begin_drain(app.update_processor.in_flight)
+    app.stop_running()
+
+async def on_startup(app):
+    with lifecycle.phase("metrics"):
+        await metrics_server.start()
+    with lifecycle.phase("database"):
+        # Independent connections, so the pool and the referral index warm up side by side
+        pool, index = await asyncio.gather(warm_up(WARM_UP_QUERIES), referral_index.start(), return_exceptions=True)
+        if isinstance(pool, Exception):
+            logger.error(f"Database warm-up failed: {pool}")
+        if isinstance(index, Exception):
+            # Lookups fall back to the database while the index retries in the background
+            logger.error(f"Could not start the referral code index: {index}")
+    sms_dispatcher.start()
+    with lifecycle.phase("broadcasts"):
+        try:
+            await broadcaster.start(app.bot)
+        except Exception as e:
+            logger.error(f"Could not resume broadcasts: {e}")
+    # SCHEDULER=off when the jobs run in a separate `python scheduler.py` worker
+    if SCHEDULER_MODE == "bot":
+        with lifecycle.phase("scheduler"):
+            from scheduler import job_scheduler
+
+            job_scheduler.start(app.bot, otp_store)
+    # post_init runs before the updater and the application start; ready waits for both
+    global ready_task
+    ready_task = asyncio.create_task(mark_ready_when_running(app))
+
+ready_task = None
+
+async def mark_ready_when_running(app):
+    """Report ready and take over the stop signals once updates are being fetched and processed"""
+    with lifecycle.phase("updater"):
+        while not app.running:
+            await asyncio.sleep(0.05)
+    if STOP_SIGNALS_HANDLED:
+        # Installed only now: before the application runs, stop_running() cannot stop it
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, begin_drain, app)
+    lifecycle.mark_ready()
+
+async def on_stop(app):
+    # PTB's stop() has finished every in-flight update and flushed persistence by now
+    lifecycle.drained()
+
+async def on_shutdown(app):
+    if ready_task and not ready_task.done():
+        # Startup was interrupted before the application ran
+        ready_task.cancel()
+    if SCHEDULER_MODE == "bot":
+        from scheduler import job_scheduler
+
+        job_scheduler.stop()
+    await broadcaster.stop()
+    await sms_dispatcher.stop()
+    await referral_index.stop()
+    await metrics_server.stop()
+    await engine.dispose()
+
+async def save_user_state(app, persistence, update):
+    await app.update_persistence()
+    await persistence.wait_written()
+
+def build_application():
+    """Build the bot application with all handlers registered"""
+    builder = ApplicationBuilder().token(str(os.getenv("BOT_TOKEN")))
+    # Point the bot at a different Bot API server (local Bot API or a fake one for testing)
+    if os.getenv("TELEGRAM_API_BASE_URL"):
+        builder = builder.base_url(os.getenv("TELEGRAM_API_BASE_URL"))
+    processor = PerUserUpdateProcessor(int(os.getenv("MAX_CONCURRENT_UPDATES", "64")))
+    builder = builder.concurrent_updates(processor)
+    # Conversation state and user_data survive restarts and are shared between replicas
+    persistence = PostgresPersistence(update_interval=float(os.getenv("PERSISTENCE_INTERVAL", "5")))
+    builder = builder.persistence(persistence)
+    app = builder.post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown).build()
+    # Each update starts from the user's state as stored by any replica, and the user's
+    # next update waits until this one's changes are written, wherever it is handled
+    processor.before_update = partial(persistence.load_user_state, app)
+    processor.after_update = partial(save_user_state, app, persistence)
+
     # Registration conversation handler
     app.add_handler(ConversationHandler(
         entry_points=[CommandHandler("register", register_func)],
+        name="register",
+        persistent=True,
         states={
             ASK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_name)],
             ASK_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_phone)],
@@ -318,6 +889,8 @@ if __name__ == "__main__":
     ))
     app.add_handler(ConversationHandler(
         entry_points=[CommandHandler("add_code", add_code_func)],
+        name="add_code",
+        persistent=True,
         states={
             ASK_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_code)],
             ASK_PRODUCT: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_product)],
@@ -329,5 +902,39 @@ if __name__ == "__main__":
     app.add_handler(CommandHandler("help", help_func))
     app.add_handler(CommandHandler("list_codes", list_codes_func))
     app.add_handler(CommandHandler("add_code", add_code_func))
+    app.add_handler(CommandHandler("bulk_codes", bulk_codes_func))
+    app.add_handler(CommandHandler("stats", stats_func))
+    app.add_handler(CommandHandler("orders", orders_func))
+    app.add_handler(CommandHandler("export", export_func))
+    app.add_handler(CommandHandler(["broadcast", "broadcast_dry"], broadcast_func))
+    app.add_handler(CommandHandler("broadcasts", broadcasts_func))
+    app.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel_func))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("csv"), bulk_import_func))
     app.add_handler(CallbackQueryHandler(inline_handler))
-    app.run_polling()
\ No newline at end of file
+    instrument_application(app)
+    return app
+
+def main():
+    global STOP_SIGNALS_HANDLED
+    app = build_application()
+    logger.info(f"Bot built in {time.perf_counter() - STARTED_AT:.2f}s")
+    # Until the application runs and ours are installed, a stop signal interrupts startup the default way
+    STOP_SIGNALS_HANDLED = True
+
+    if os.getenv("BOT_MODE", "polling") == "webhook":
+        # Telegram (or a fake client in tests) POSTs updates to http://<listen>:<port>/<path>
+        url_path = os.getenv("WEBHOOK_PATH", "telegram")
+        app.run_webhook(
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            url_path=url_path,
+            webhook_url=os.getenv("WEBHOOK_URL"),
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100")),
+            stop_signals=None,
+        )
+    else:
+        app.run_polling(stop_signals=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+from aiolimiter import AsyncLimiter
+
+from metrics import SMS_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Called once per message with (delivered, error_text) when the dispatcher is done with it
+ResultCallback = Callable[[bool, Optional[str]], Awaitable[None]]
+
+
+class SmsError(Exception):
+    """Raised by providers when a message could not be sent"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class SmsMessage:
+    """A verify-lookup SMS waiting in the dispatch queue"""
+
+    __slots__ = ("receptor", "token", "template", "on_result", "attempts", "queued_at")
+
+    def __init__(self, receptor: str, token: str, template: str, on_result: Optional[ResultCallback] = None):
+        self.receptor = receptor
+        self.token = token
+        self.template = template
+        self.on_result = on_result
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+
+
+class KavenegarProvider:
+    """Kavenegar verify/lookup over a pooled async HTTP client"""
+
+    name = "kavenegar"
+
+    def __init__(self, api_key: str, rate_per_second: float = 5, timeout: float = 10.0):
+        self.api_key = api_key
+        self.rate_per_second = rate_per_second
+        self._client = httpx.AsyncClient(
+            base_url=f"https://api.kavenegar.com/v1/{api_key}",
+            timeout=timeout,
+            headers={"Accept": "application/json"},
+        )
+
+    async def send_verify(self, receptor: str, token: str, template: str):
+        try:
+            response = await self._client.post(
+                "/verify/lookup.json",
+                data={"receptor": receptor, "token": token, "template": template, "type": "sms"},
+            )
+        except httpx.HTTPError as e:
+            raise SmsError(f"HTTP error: {e}") from e
+
+        try:
+            body = response.json()
+            status = body["return"]["status"]
+            message = body["return"]["message"]
+        except (ValueError, KeyError) as e:
+            raise SmsError(f"Invalid response ({response.status_code})") from e
+
+        if status != 200:
+            # 4xx statuses are permanent (bad receptor, no credit, bad template)
+            raise SmsError(f"APIException[{status}] {message}", retryable=status >= 500)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class StubProvider:
+    """Offline provider that records messages instead of sending them"""
+
+    name = "stub"
+
+    def __init__(self, rate_per_second: float = 1000, latency: float = 0.0, failure_rate: float = 0.0):
+        self.rate_per_second = rate_per_second
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent: dict[str, str] = {}  # receptor -> last token
+        self.sent_count = 0
+
+    async def send_verify(self, receptor: str, token: str, template: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise SmsError("stub failure")
+        self.sent[receptor] = token
+        self.sent_count += 1
+
+    async def close(self):
+        pass
+
+
+def provider_from_env():
+    """Build the SMS provider selected by the SMS_PROVIDER environment variable"""
+    name = os.getenv("SMS_PROVIDER", "kavenegar")
+    rate = float(os.getenv("SMS_RATE_PER_SECOND", "5"))
+    if name == "stub":
+        return StubProvider(latency=float(os.getenv("SMS_STUB_LATENCY", "0")))
+    return KavenegarProvider(os.getenv("KAVENEGAR_API_KEY", ""), rate_per_second=rate)
+
+
+class SmsDispatcher:
+    """Bounded queue of outgoing SMS drained by a pool of async workers.
+
+    Handlers call submit() and return immediately; workers send through the
+    provider under its rate limit, retry transient failures with exponential
+    backoff and report the outcome through the message's callback.
+    """
+
+    def __init__(self, provider, workers: int = 4, queue_size: int = 1000,
+                 max_attempts: int = 3, backoff: float = 0.5):
+        self.provider = provider
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.limiter = AsyncLimiter(provider.rate_per_second, 1)
+        self._queue: asyncio.Queue[SmsMessage] = asyncio.Queue(maxsize=queue_size)
+        self._tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i), name=f"sms-worker-{i}") for i in range(self.workers)]
+        logger.info(f"SMS dispatcher started with {self.workers} workers ({self.provider.name})")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """Give queued messages a chance to go out, then stop the workers"""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"SMS dispatcher stopped with {self.pending} messages still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.provider.close()
+
+    def submit(self, receptor: str, token: str, template: str = "verify",
+               on_result: Optional[ResultCallback] = None) -> bool:
+        """Queue a message; returns False when the queue is full"""
+        try:
+            self._queue.put_nowait(SmsMessage(receptor, token, template, on_result))
+            return True
+        except asyncio.QueueFull:
+            logger.warning("SMS queue is full, rejecting message")
+            return False
+
+    async def _worker(self, index: int):
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._deliver(message)
+            except Exception as e:
+                logger.exception(f"SMS worker {index} crashed on a message: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, message: SmsMessage):
+        error = None
+        while message.attempts < self.max_attempts:
+            message.attempts += 1
+            try:
+                async with self.limiter:
+                    start = time.perf_counter()
+                    await self.provider.send_verify(message.receptor, message.token, message.template)
+                SMS_LATENCY.observe(time.perf_counter() - start, self.provider.name, "ok")
+                self.sent += 1
+                await self._report(message, True, None)
+                return
+            except SmsError as e:
+                SMS_LATENCY.observe(time.perf_counter() - start, self.provider.name, "error")
+                error = str(e)
+                logger.warning(f"SMS to {message.receptor} failed (attempt {message.attempts}): {e}")
+                if not e.retryable:
+                    break
+            if message.attempts < self.max_attempts:
+                delay = self.backoff * 2 ** (message.attempts - 1)
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+        self.failed += 1
+        await self._report(message, False, error)
+
+    async def _report(self, message: SmsMessage, delivered: bool, error: Optional[str]):
+        if message.on_result is None:
+            return
+        try:
+            await message.on_result(delivered, error)
+        except Exception as e:
+            logger.error(f"SMS result callback failed: {e}")
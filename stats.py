@@ -0,0 +1,75 @@
+import asyncio
+import sys
+from datetime import date, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import select, text
+
+from db import AsyncSessionLocal, engine
+from models import OrderStatusEnum, Product, SellerDailySales, SellerProductSales, SellerSalesTotal
+
+
+class SellerStats(NamedTuple):
+    totals: dict  # status -> (order_count, revenue, discount_total)
+    products: list  # [(product name, order_count, revenue)] for approved orders, best first
+    days: list  # [(day, order_count, revenue)] for approved orders, last `days` days
+
+
+async def seller_stats(seller_id: int, days: int = 7, top_products: int = 5) -> SellerStats:
+    """Read a seller's sales figures from the rollup tables"""
+    since = date.today() - timedelta(days=days - 1)
+    async with AsyncSessionLocal() as session:
+        totals = await session.execute(
+            select(SellerSalesTotal.status, SellerSalesTotal.order_count, SellerSalesTotal.revenue, SellerSalesTotal.discount_total)
+            .where(SellerSalesTotal.seller_id == seller_id)
+        )
+        products = await session.execute(
+            select(Product.name, SellerProductSales.order_count, SellerProductSales.revenue)
+            .join(Product, Product.id == SellerProductSales.product_id)
+            .where(SellerProductSales.seller_id == seller_id, SellerProductSales.status == OrderStatusEnum.APPROVED)
+            .order_by(SellerProductSales.revenue.desc())
+            .limit(top_products)
+        )
+        daily = await session.execute(
+            select(SellerDailySales.day, SellerDailySales.order_count, SellerDailySales.revenue)
+            .where(
+                SellerDailySales.seller_id == seller_id,
+                SellerDailySales.status == OrderStatusEnum.APPROVED,
+                SellerDailySales.day >= since,
+            )
+            .order_by(SellerDailySales.day)
+        )
+        return SellerStats(
+            totals={row.status: (row.order_count, row.revenue, row.discount_total) for row in totals.all()},
+            products=[tuple(row) for row in products.all()],
+            days=[tuple(row) for row in daily.all()],
+        )
+
+
+async def rebuild_rollups():
+    """Recompute every rollup table from orders in one transaction.
+
+    Blocks order writes while it scans every order, so it is only run by hand
+    (`python stats.py rebuild`, off-peak) to repair the rollups after orders
+    were changed with the trigger disabled; the trigger keeps them exact otherwise.
+    """
+    async with AsyncSessionLocal() as session:
+        await session.execute(text("SELECT seller_sales_rebuild()"))
+        await session.commit()
+
+
+async def _main(command: str):
+    try:
+        if command == "rebuild":
+            await rebuild_rollups()
+            print("Seller sales rollups rebuilt")
+        else:
+            print(f"Unknown command: {command}")
+            sys.exit(1)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    # python stats.py rebuild
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "rebuild"))
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import sys
+from typing import Any, Awaitable, Callable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each user's updates in order.
+
+    Updates from different users run in parallel (up to max_workers at a
+    time); updates from the same user wait on a per-user FIFO lock, so
+    ConversationHandler state transitions never interleave. The worker
+    limit is applied after the per-user lock is taken, so a user with a
+    backlog of updates does not hold worker slots while waiting.
+
+    before_update and after_update run under the same lock, around each
+    update that has a user (used to load and save that user's state).
+    """
+
+    def __init__(self, max_workers: int = 64):
+        # PTB's own semaphore would be taken before our per-user lock, so keep
+        # it out of the way and apply the real limit in do_process_update.
+        super().__init__(sys.maxsize)
+        self.max_workers = max_workers
+        self._workers = asyncio.BoundedSemaphore(max_workers)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._waiters: dict[int, int] = {}
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.before_update: Optional[Callable[[object], Awaitable[None]]] = None
+        self.after_update: Optional[Callable[[object], Awaitable[None]]] = None
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._key(update)
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            if key is None:
+                async with self._workers:
+                    await coroutine
+                return
+
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = asyncio.Lock()
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            try:
+                async with lock:
+                    async with self._workers:
+                        await self._hook(self.before_update, update)
+                        await coroutine
+                    # Holds up only this user's next update, not a worker slot
+                    await self._hook(self.after_update, update)
+            finally:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    del self._waiters[key]
+                    del self._locks[key]
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    @staticmethod
+    async def _hook(hook, update: object):
+        if hook is None:
+            return
+        try:
+            await hook(update)
+        except Exception as e:
+            # The update still runs, on this process's copy of the state
+            logger.error(f"Update hook {getattr(hook, '__name__', hook)} failed: {e}")
+
+    async def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no update is being processed; returns False on timeout"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass